@@ -1,31 +1,68 @@
 # api/cds.py
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import asyncio
+import json
 import re
 from typing import Dict, Any, List, Optional
 
-from api.pubmed import pubmed_search
+import orjson
+
+from api.pubmed import pubmed_search, pubmed_summaries
 from api.models import get_llm
+from api.config.settings import settings
+from api.cds_cache import ctx_cache, rerank_cache, ctx_key, rerank_key
 
 __all__ = ["build_context_from_json", "suggest_cds"]
 
+# --------- Patrones precompilados (texto/dx ya vienen en minúsculas) ---------
+_CHEST_PAIN_DX_RE = re.compile(r"dolor torácico")
+_CHEST_PAIN_RE = re.compile(r"dolor torácico|opresivo en el pecho")
+_ASTHMA_DX_RE = re.compile(r"asma")
+_ASTHMA_RE = re.compile(r"sibilancias|asma pediátrica|tos nocturna")
+_PNEU_RE = re.compile(r"neumon[íi]a|\bnac\b")
+_COUGH_RE = re.compile(r"tos|esputo")
+_PARACETAMOL_CI_RE = re.compile(r"alergia a paracetamol|hepatopatía")
+_FEVER_TEMP_RE = re.compile(r"\b(?:38[.,]\d|3[89])\b")
+_SAT_RE = re.compile(r"(\d{2,3})")
+
+# --------- Consultas PubMed por escenario ---------
+_Q_CHEST_PAIN = "chest pain emergency guideline troponin ECG"
+_Q_ASTHMA = "pediatric asthma acute exacerbation SABA guideline"
+_Q_PNEU = "community acquired pneumonia outpatient guideline adult"
+
+# El rerank devuelve como mucho este número de candidatos
+_RERANK_TOP = 3
+
 # --------- Helpers de texto ---------
 def _lower(s: Optional[str]) -> str:
     return (s or "").strip().lower()
 
 def _as_text(x: Any) -> str:
-    if isinstance(x, str):
-        return x
-    if isinstance(x, dict):
-        # concatena valores simples
-        return " ".join(str(v) for v in x.values() if isinstance(v, (str, int, float)))
-    if isinstance(x, list):
-        return " ".join(_as_text(v) for v in x)
-    return str(x) if x is not None else ""
+    # DFS iterativo: un solo buffer de partes y un único join al final
+    parts: List[str] = []
+    stack = [x]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, str):
+            parts.append(v)
+        elif isinstance(v, dict):
+            # concatena valores simples
+            parts.extend(str(vv) for vv in v.values() if isinstance(vv, (str, int, float)))
+        elif isinstance(v, list):
+            stack.extend(reversed(v))
+        elif v is not None:
+            parts.append(str(v))
+    return " ".join(parts)
 
 # --------- Contexto desde JSON clínico ---------
 def build_context_from_json(j: Dict[str, Any]) -> Dict[str, Any]:
     j = j or {}
+    key = ctx_key(j)
+    hit = ctx_cache.get(key)
+    if hit is not None:
+        # copia superficial: los llamadores añaden claves (p.ej. "_schema")
+        return dict(hit)
     texto = " ".join([
         _as_text(j.get("motivo_consulta")),
         _as_text(j.get("enfermedad_actual")),
@@ -49,6 +86,7 @@ def build_context_from_json(j: Dict[str, Any]) -> Dict[str, Any]:
         "chief_complaint": j.get("motivo_consulta") or "",
         "diagnosis": (dx_list[0] if dx_list else ""),
         "dx": dx_list,
+        "dx_joined": " ".join(dx_list),
         "texto": (texto + " " + vitals_text).strip().lower(),
         "age": j.get("edad") or j.get("age"),
         "alergias": j.get("alergias") or [],
@@ -60,7 +98,8 @@ def build_context_from_json(j: Dict[str, Any]) -> Dict[str, Any]:
             "SatO2": ef.get("SatO2"),
         }
     }
-    return ctx
+    ctx_cache.put(key, ctx)
+    return dict(ctx)
 
 # --------- Reglas básicas según escenario ---------
 def _is_pediatric(ctx: Dict[str, Any]) -> bool:
@@ -69,19 +108,22 @@ def _is_pediatric(ctx: Dict[str, Any]) -> bool:
     except Exception:
         return False
 
-def _has_term(ctx: Dict[str, Any], *terms: str) -> bool:
-    t = ctx.get("texto", "")
-    return any(term.lower() in t for term in terms)
+def _has_term(ctx: Dict[str, Any], pattern: re.Pattern) -> bool:
+    return pattern.search(ctx.get("texto", "")) is not None
 
-def _has_dx(ctx: Dict[str, Any], *terms: str) -> bool:
-    dx = ctx.get("dx") or []
-    s = " ".join(dx)
-    return any(term.lower() in s for term in terms)
+def _has_dx(ctx: Dict[str, Any], pattern: re.Pattern) -> bool:
+    joined = ctx.get("dx_joined")
+    if joined is None:
+        # ctx armado a mano (sin build_context_from_json)
+        joined = " ".join(ctx.get("dx") or [])
+    return pattern.search(joined) is not None
 
 def _low_saturation(ctx: Dict[str, Any]) -> bool:
     s = ctx.get("vitals", {}).get("SatO2")
     if not s: return False
-    m = re.search(r"(\d{2,3})", str(s))
+    if isinstance(s, (int, float)) and not isinstance(s, bool):
+        return s < 93
+    m = _SAT_RE.search(str(s))
     if not m: return False
     try:
         return int(m.group(1)) < 93
@@ -93,64 +135,109 @@ def _fever(ctx: Dict[str, Any]) -> bool:
     if "fiebre" in text: 
         return True
     temp = ctx.get("vitals", {}).get("Temp")
-    if temp and re.search(r"\b(38(\.|,)\d|3[89])\b", str(temp)):
+    if isinstance(temp, (int, float)) and not isinstance(temp, bool):
+        return temp >= 38.0
+    if temp and _FEVER_TEMP_RE.search(str(temp)):
         return True
     return False
 
 # --------- PubMed util ---------
-async def _pubmed_for(query: str, k: int = 3) -> List[Dict[str, Any]]:
+async def _search_ids(query: str, k: int = 3) -> List[str]:
     try:
         res = await pubmed_search(query, retmax=k)
-        items = []
-        for r in (res.get("results") or [])[:k]:
-            items.append({
-                "pmid": str(r.get("pmid") or r.get("id") or ""),
-                "title": r.get("title") or f"PubMed record {r.get('pmid')}",
-                "year": r.get("year"),
-            })
-        return items
+        return [str(p) for p in (res.get("ids") or [])[:k]]
     except Exception:
         return []
 
+async def _pubmed_many(queries: List[str], k: int = 3) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Lanza todas las búsquedas a la vez y trae los títulos de la unión de PMIDs
+    con un solo esummary; el tiempo total es el de la búsqueda más lenta + 1 RTT.
+    """
+    queries = list(dict.fromkeys(queries))
+    id_lists = await asyncio.gather(*[_search_ids(q, k=k) for q in queries])
+    try:
+        docs = await pubmed_summaries(p for ids in id_lists for p in ids)
+    except Exception:
+        docs = {}
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for q, ids in zip(queries, id_lists):
+        out[q] = [{
+            "pmid": p,
+            "title": (docs.get(p) or {}).get("title") or f"PubMed record {p}",
+            "year": (docs.get(p) or {}).get("year"),
+        } for p in ids]
+    return out
+
 # --------- Rerank con LLaMA ---------
+def _ck(c: Dict[str, Any]) -> str:
+    """Clave de emparejamiento candidato↔respuesta (tolera espacios/mayúsculas del LLM)."""
+    return (c.get("message") or c.get("proposed") or "").strip().casefold()
+
 async def _rerank_with_llm(ctx: Dict[str, Any], candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """ Reordena/filtra propuestas con LLM para que no repita siempre lo mismo. """
-    if not candidates:
+    # Con 3 o menos no hay nada que elegir: evitamos una inferencia completa
+    if len(candidates) <= _RERANK_TOP:
         return candidates
+    # Caché solo si el llamador acepta respuestas repetidas (temperatura 0 o cache_ok)
+    use_cache = bool(ctx.get("cache_ok")) or ctx.get("temperature", 0.2) == 0
+    key = rerank_key(ctx, candidates) if use_cache else None
+    if key is not None:
+        hit = rerank_cache.get(key)
+        if hit is not None:
+            return list(hit)
+    out = await _rerank_uncached(ctx, candidates)
+    if key is not None:
+        rerank_cache.put(key, out)
+    return out
+
+async def _rerank_uncached(ctx: Dict[str, Any], candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     llm = get_llm()
-    # preparamos un prompt muy acotado para ranking
+    # preparamos un prompt muy acotado para ranking (salida JSON estructurada)
+    payload = {"candidates": [
+        {"type": c.get("type", "info"), "message": c.get("message") or c.get("proposed")}
+        for c in candidates
+    ]}
     user = (
         "Contexto clínico breve:\n"
         f"- CC: {ctx.get('chief_complaint')}\n"
         f"- DX: {', '.join(ctx.get('dx') or [])}\n"
         f"- Edad: {ctx.get('age')}\n"
         f"- Vitals: {ctx.get('vitals')}\n\n"
-        "Candidatos (elige los 3 mejores como lista JSON, con igual formato):\n"
-        + "\n".join([f"{i+1}. {c.get('type','info')}: {c.get('message') or c.get('proposed')}" for i,c in enumerate(candidates)])
-        + "\n\nResponde SOLO un array JSON con los mejores candidatos (máximo 3)."
+        "Candidatos:\n"
+        + json.dumps(payload, ensure_ascii=False)
+        + '\n\nResponde SOLO un objeto JSON {"ranked": [...]} con los mejores candidatos '
+        "(máximo 3), con igual formato que en \"candidates\"."
     )
     text = await llm.chat(
         messages=[
             {"role": "system", "content": "Eres un asistente clínico. No inventes. Mantén formato JSON."},
             {"role": "user", "content": user},
         ],
-        temperature=0.2,
-        max_tokens=None,
+        temperature=ctx.get("temperature", 0.2),
+        max_tokens=256,
+        json_mode=settings.OLLAMA_JSON_ENFORCE,
+        cache=False,  # rerank_cache ya decide si se reutiliza
     )
-    import json
     try:
-        arr = json.loads(text)
+        obj = orjson.loads(text)
+        # Sin modo JSON algunos modelos devuelven directamente el array
+        arr = obj.get("ranked", []) if isinstance(obj, dict) else obj
         if isinstance(arr, list) and arr:
             # Intentamos mapear por texto para conservar pmids/safety_notes
-            m = { (c.get("message") or c.get("proposed") or "").strip(): c for c in candidates }
+            m = {_ck(c): c for c in candidates}
             out = []
             for it in arr:
-                key = (it.get("message") or it.get("proposed") or "").strip()
-                out.append(m.get(key, it))
-            return out[:3]
+                if not isinstance(it, dict):
+                    continue
+                out.append(m.get(_ck(it), it))
+                if len(out) == _RERANK_TOP:
+                    break
+            if out:
+                return out
     except Exception:
         pass
-    return candidates[:3]
+    return candidates[:_RERANK_TOP]
 
 # --------- Motor de sugerencias ---------
 async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max: int = 3) -> List[Dict[str, Any]]:
@@ -168,8 +255,18 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
     """
     suggestions: List[Dict[str, Any]] = []
 
+    # Escenarios disparados (se evalúan antes para pedir toda la evidencia en paralelo)
+    chest_pain = _has_dx(ctx, _CHEST_PAIN_DX_RE) or _has_term(ctx, _CHEST_PAIN_RE)
+    asthma = not chest_pain and _is_pediatric(ctx) and (_has_dx(ctx, _ASTHMA_DX_RE) or _has_term(ctx, _ASTHMA_RE))
+    pneumonia = not (chest_pain or asthma) and (_has_dx(ctx, _PNEU_RE) or (_fever(ctx) and _has_term(ctx, _COUGH_RE)))
+
+    evidence: Dict[str, List[Dict[str, Any]]] = {}
+    if use_pubmed:
+        queries = [q for q, hit in ((_Q_CHEST_PAIN, chest_pain), (_Q_ASTHMA, asthma), (_Q_PNEU, pneumonia)) if hit]
+        evidence = await _pubmed_many(queries, k=pubmed_max)
+
     # ===== 1) DOLOR TORÁCICO =====
-    if _has_dx(ctx, "dolor torácico") or _has_term(ctx, "dolor torácico", "opresivo en el pecho"):
+    if chest_pain:
         msg = "Dolor torácico: priorizar protocolo de SCA — ECG y troponinas, monitorización y derivación si inestabilidad."
         item = {
             "type": "guideline",
@@ -177,7 +274,7 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
             "safety_notes": ["No retrasar evaluación de SCA por analgesia."],
         }
         if use_pubmed:
-            ev = await _pubmed_for("chest pain emergency guideline troponin ECG", k=pubmed_max)
+            ev = evidence.get(_Q_CHEST_PAIN, [])
             item["evidence"] = ev
             item["pmids"] = [e["pmid"] for e in ev if e.get("pmid")]
         suggestions.append(item)
@@ -186,7 +283,7 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
         return await _rerank_with_llm(ctx, suggestions)
 
     # ===== 2) ASMA PEDIÁTRICA =====
-    if _is_pediatric(ctx) and (_has_dx(ctx, "asma") or _has_term(ctx, "sibilancias", "asma pediátrica", "tos nocturna")):
+    if asthma:
         saba = "Salbutamol (SABA) 100 mcg inhalado: 2–4 inhalaciones con cámara, repetir cada 20 min × 1 h si síntomas; luego según respuesta."
         sug1 = {
             "type": "medication",
@@ -195,7 +292,7 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
             "safety_notes": ["Revisar técnica de inhalación y uso de cámara espaciadora."],
         }
         if use_pubmed:
-            ev = await _pubmed_for("pediatric asthma acute exacerbation SABA guideline", k=pubmed_max)
+            ev = evidence.get(_Q_ASTHMA, [])
             sug1["evidence"] = ev
             sug1["pmids"] = [e["pmid"] for e in ev if e.get("pmid")]
         suggestions.append(sug1)
@@ -210,7 +307,7 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
         return await _rerank_with_llm(ctx, suggestions)
 
     # ===== 3) NEUMONÍA ADQUIRIDA EN LA COMUNIDAD (adulto) =====
-    if _has_dx(ctx, "neumonía", "neumonia", "nac") or (_fever(ctx) and _has_term(ctx, "tos", "esputo")):
+    if pneumonia:
         base = "En NAC ambulatoria sin criterios de gravedad: control sintomático, hidratación, signos de alarma y reevaluación si empeora."
         sug = {
             "type": "guideline",
@@ -218,13 +315,13 @@ async def suggest_cds(ctx: Dict[str, Any], use_pubmed: bool = True, pubmed_max:
             "safety_notes": ["Derivar si SatO2 baja, taquipnea marcada, hipotensión o alteración del estado mental."],
         }
         if use_pubmed:
-            ev = await _pubmed_for("community acquired pneumonia outpatient guideline adult", k=pubmed_max)
+            ev = evidence.get(_Q_PNEU, [])
             sug["evidence"] = ev
             sug["pmids"] = [e["pmid"] for e in ev if e.get("pmid")]
         suggestions.append(sug)
 
         # evitar meter siempre un analgésico; solo si hay dolor/fiebre y NO hay contraindicaciones
-        if _fever(ctx) and not _has_term(ctx, "alergia a paracetamol", "hepatopatía"):
+        if _fever(ctx) and not _has_term(ctx, _PARACETAMOL_CI_RE):
             par = "Antitérmico/analgésico: paracetamol 500–1000 mg VO cada 8 h según necesidad (máx. 3 g/día en adulto)."
             suggestions.append({
                 "type": "medication",
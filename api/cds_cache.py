@@ -0,0 +1,31 @@
+# api/cds_cache.py
+# -*- coding: utf-8 -*-
+"""Cachés del motor CDS: contexto por JSON clínico y rerank LLM por candidatos."""
+from __future__ import annotations
+import hashlib
+from typing import Any, Dict, List
+
+import orjson
+
+from api.utils.cache import LRUCache
+
+__all__ = ["ctx_cache", "rerank_cache", "ctx_key", "rerank_key", "stats"]
+
+ctx_cache = LRUCache(maxsize=512)
+rerank_cache = LRUCache(maxsize=256, ttl=600)
+
+def _md5(obj: Any) -> str:
+    # orjson ya devuelve bytes: sin paso intermedio str→bytes
+    b = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.md5(b).hexdigest()
+
+def ctx_key(j: Dict[str, Any]) -> str:
+    return _md5(j or {})
+
+def rerank_key(ctx: Dict[str, Any], candidates: List[Dict[str, Any]]) -> str:
+    # Solo los campos que entran al prompt de rerank
+    head = [ctx.get("chief_complaint"), ctx.get("dx"), ctx.get("age"), ctx.get("vitals")]
+    return _md5([head, candidates])
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {"ctx": ctx_cache.stats(), "rerank": rerank_cache.stats()}
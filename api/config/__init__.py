@@ -4,6 +4,7 @@
 from .settings import settings
 from .constants import (
     VITALS_REGEX,
+    VITALS_PATTERNS,
     MAX_ENFERMEDAD_ACTUAL_LENGTH,
     DEFAULT_SYSTEM_PROMPT,
 )
@@ -11,6 +12,7 @@ from .constants import (
 __all__ = [
     "settings",
     "VITALS_REGEX",
+    "VITALS_PATTERNS",
     "MAX_ENFERMEDAD_ACTUAL_LENGTH",
     "DEFAULT_SYSTEM_PROMPT",
 ]
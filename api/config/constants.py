@@ -5,7 +5,7 @@ import re
 
 # ========= Regex Patterns =========
 
-# Regex para extraer signos vitales del texto
+# Regex para extraer signos vitales del texto (patrón combinado, legado)
 VITALS_REGEX = re.compile(
     r"""
     (?:TA[:\s]*([\d]{2,3}\s*[\/]\s*[\d]{2,3}))?
@@ -17,6 +17,22 @@ VITALS_REGEX = re.compile(
     re.IGNORECASE | re.DOTALL | re.VERBOSE,
 )
 
+# Un patrón independiente por signo vital, anclado a su etiqueta: sin el
+# pegamento ".*?" entre grupos opcionales no hay backtracking cruzado.
+_TA_RE = re.compile(r"\bTA[:\s]*(\d{2,3}\s*/\s*\d{2,3})", re.IGNORECASE)
+_FC_RE = re.compile(r"\bFC[:\s]*(\d{2,3})", re.IGNORECASE)
+_FR_RE = re.compile(r"\bFR[:\s]*(\d{2,3})", re.IGNORECASE)
+_TEMP_RE = re.compile(r"\bTemp(?:eratura)?[:\s]*(\d{2}(?:[.,]\d)?)", re.IGNORECASE)
+_SAT_RE = re.compile(r"\bSatO2?[:\s]*(\d{2,3})", re.IGNORECASE)
+
+VITALS_PATTERNS = {
+    "TA": _TA_RE,
+    "FC": _FC_RE,
+    "FR": _FR_RE,
+    "Temp": _TEMP_RE,
+    "SatO2": _SAT_RE,
+}
+
 # ========= Limits =========
 
 # Recorte de Enfermedad Actual si viene muy larga
@@ -2,88 +2,96 @@
 """Application settings and configuration."""
 
 import os
-from typing import List
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Tuple
 
+from .constants import DEFAULT_SYSTEM_PROMPT
 
+
+def _env(name: str, default: str) -> Callable[[], str]:
+    return lambda: os.getenv(name, default)
+
+
+def _env_int(name: str, default: str) -> Callable[[], int]:
+    return lambda: int(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: str) -> Callable[[], bool]:
+    return lambda: os.getenv(name, default).lower() == "true"
+
+
+def _llm_model() -> str:
+    # Compatibilidad: si defines OLLAMA_MODEL_PRIMARY en .env, lo usamos; si no, LLM_MODEL
+    return os.getenv("LLM_MODEL") or os.getenv("OLLAMA_MODEL_PRIMARY") or "llama3:8b"
+
+
+@dataclass(frozen=True, slots=True)
 class Settings:
-    """Application settings loaded from environment variables."""
+    """Application settings loaded from environment variables (read-only)."""
 
     # ========= API / Infra =========
-    API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
-    API_PORT: int = int(os.getenv("API_PORT", "8080"))
-    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "info")
+    API_HOST: str = field(default_factory=_env("API_HOST", "0.0.0.0"))
+    API_PORT: int = field(default_factory=_env_int("API_PORT", "8080"))
+    LOG_LEVEL: str = field(default_factory=_env("LOG_LEVEL", "info"))
+    # Cada worker carga su propio modelo ASR: subir con cuidado
+    API_WORKERS: int = field(default_factory=_env_int("API_WORKERS", "1"))
+    ACCESS_LOG: bool = field(default_factory=_env_bool("ACCESS_LOG", "false"))
 
     # CORS - acepta lista separada por comas; '*' para permitir todo en dev
-    CORS_ALLOWED: List[str] = [
-        o.strip() for o in os.getenv("CORS_ALLOWED", "*").split(",")
-    ]
+    CORS_ALLOWED: Tuple[str, ...] = field(
+        default_factory=lambda: tuple(o.strip() for o in os.getenv("CORS_ALLOWED", "*").split(",") if o.strip())
+    )
 
     # ========= Directories =========
-    TMP_DIR: str = os.getenv("TMP_DIR", "/tmp")
-    DATA_DIR: str = os.getenv("DATA_DIR", "/data")
-    KNOWLEDGE_DIR: str = os.getenv("KNOWLEDGE_DIR", "/app/knowledge")
+    TMP_DIR: str = field(default_factory=_env("TMP_DIR", "/tmp"))
+    DATA_DIR: str = field(default_factory=_env("DATA_DIR", "/data"))
+    KNOWLEDGE_DIR: str = field(default_factory=_env("KNOWLEDGE_DIR", "/app/knowledge"))
 
     # ========= FHIR =========
-    FHIR_BASE_URL: str = os.getenv("FHIR_BASE_URL", "http://hapi:8080/fhir")
+    FHIR_BASE_URL: str = field(default_factory=_env("FHIR_BASE_URL", "http://hapi:8080/fhir"))
 
     # ========= LLaMA (Ollama) =========
-    OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://scribe_ollama:11434")
+    OLLAMA_BASE_URL: str = field(default_factory=_env("OLLAMA_BASE_URL", "http://scribe_ollama:11434"))
+    LLM_MODEL: str = field(default_factory=_llm_model)
+    OLLAMA_MODEL_FALLBACK: str = field(default_factory=lambda: os.getenv("OLLAMA_MODEL_FALLBACK", _llm_model()))
 
-    # Compatibilidad: si defines OLLAMA_MODEL_PRIMARY en .env, lo usamos; si no, LLM_MODEL
-    LLM_MODEL: str = (
-        os.getenv("LLM_MODEL") or os.getenv("OLLAMA_MODEL_PRIMARY") or "llama3:8b"
-    )
-    OLLAMA_MODEL_FALLBACK: str = os.getenv("OLLAMA_MODEL_FALLBACK", LLM_MODEL)
+    # Pool del cliente httpx compartido (LLM/PubMed/FHIR); subir junto con
+    # OLLAMA_NUM_PARALLEL del servidor, si no el pool serializa las ráfagas
+    LLM_MAX_CONNECTIONS: int = field(default_factory=_env_int("LLM_MAX_CONNECTIONS", "64"))
+    LLM_MAX_KEEPALIVE: int = field(default_factory=_env_int("LLM_MAX_KEEPALIVE", "32"))
+
+    # Tiempo que Ollama mantiene el modelo cargado tras cada llamada
+    OLLAMA_KEEP_ALIVE: str = field(default_factory=_env("OLLAMA_KEEP_ALIVE", "30m"))
 
     # Forzar salida JSON desde el LLM
-    OLLAMA_JSON_ENFORCE: bool = os.getenv("OLLAMA_JSON_ENFORCE", "true").lower() == "true"
+    OLLAMA_JSON_ENFORCE: bool = field(default_factory=_env_bool("OLLAMA_JSON_ENFORCE", "true"))
 
     # ========= ASR (faster-whisper) =========
-    ASR_MODEL: str = os.getenv("ASR_MODEL", "base")
-    ASR_COMPUTE_TYPE: str = os.getenv("ASR_COMPUTE_TYPE", "int8")
-    ASR_LANGUAGE: str = os.getenv("ASR_LANGUAGE", "es")
-    ASR_SAMPLE_RATE: int = int(os.getenv("ASR_SAMPLE_RATE", "16000"))
-    ASR_MAX_MINUTES: int = int(os.getenv("ASR_MAX_MINUTES", "15"))
-    ASR_VAD: bool = os.getenv("ASR_VAD", "true").lower() == "true"
+    ASR_MODEL: str = field(default_factory=_env("ASR_MODEL", "base"))
+    ASR_COMPUTE_TYPE: str = field(default_factory=_env("ASR_COMPUTE_TYPE", "int8"))
+    ASR_LANGUAGE: str = field(default_factory=_env("ASR_LANGUAGE", "es"))
+    ASR_SAMPLE_RATE: int = field(default_factory=_env_int("ASR_SAMPLE_RATE", "16000"))
+    ASR_MAX_MINUTES: int = field(default_factory=_env_int("ASR_MAX_MINUTES", "15"))
+    ASR_VAD: bool = field(default_factory=_env_bool("ASR_VAD", "true"))
 
     # ========= PubMed =========
-    PUBMED_EUTILS_BASE: str = os.getenv(
-        "PUBMED_EUTILS_BASE",
-        "https://eutils.ncbi.nlm.nih.gov/entrez/eutils",
+    PUBMED_EUTILS_BASE: str = field(
+        default_factory=_env("PUBMED_EUTILS_BASE", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
     )
-    PUBMED_EMAIL: str = os.getenv("PUBMED_EMAIL", "you@example.com")
+    PUBMED_EMAIL: str = field(default_factory=_env("PUBMED_EMAIL", "you@example.com"))
+    # Con API key NCBI permite 10 req/s en vez de 3
+    PUBMED_API_KEY: str = field(default_factory=_env("PUBMED_API_KEY", ""))
 
     # ========= System Prompt =========
-    SYSTEM_PROMPT: str = os.getenv(
-        "SYSTEM_PROMPT",
-        (
-            "Eres un asistente médico experto que transforma turnos DOCTOR/PACIENTE en una HISTORIA CLÍNICA "
-            "completa y estructurada. Devuelve SOLO un JSON VÁLIDO que siga EXACTAMENTE el siguiente esquema. "
-            "Incluye el máximo detalle clínico explícito del transcript y, cuando sea muy obvio por contexto, "
-            "puedes inferir mínimamente (si no hay dato, omite la clave). No repitas tokens como 's s s s'.\n\n"
-            "Esquema requerido:\n"
-            "{\n"
-            '  "motivo_consulta": string,\n'
-            '  "enfermedad_actual": string | {\n'
-            '      "sintomas": string,\n'
-            '      "evolucion": string,\n'
-            '      "factores_riesgo": [string]\n'
-            "  },\n"
-            '  "antecedentes": [string],\n'
-            '  "examen_fisico": {\n'
-            '      "TA": string, "Temp": string, "FC": string, "FR": string, "SatO2": string, "hallazgos": string\n'
-            "  },\n"
-            '  "impresion_dx": [string],\n'
-            '  "ordenes": [{"detalle": string}],\n'
-            '  "recetas": [{"detalle": string}],\n'
-            '  "alertas": [string]\n'
-            "}\n\n"
-            "Reglas: 1) Mantén terminología clínica estándar. 2) Extrae y normaliza signos vitales con unidades "
-            "(TA en mmHg, FC en lpm, FR en rpm, Temp en °C, SatO2 en %). 3) Si el examen físico viene sin unidad, añade la apropiada. "
-            "4) No escribas nada fuera del JSON."
-        ),
-    )
+    SYSTEM_PROMPT: str = field(default_factory=_env("SYSTEM_PROMPT", DEFAULT_SYSTEM_PROMPT))
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Instancia única de Settings, construida una sola vez por proceso."""
+    return Settings()
 
 
-# Singleton instance
-settings = Settings()
+# Singleton instance (compatibilidad)
+settings = get_settings()
@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 """ASR dependencies and configuration."""
 
+import asyncio
 import os
-from typing import List, Dict, Any, Optional
+import re
+import threading
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional
 
+import numpy
 from faster_whisper import WhisperModel
 from api.config import settings
 
@@ -21,6 +25,8 @@ ASR_VAD_THRESHOLD  = float(os.getenv("ASR_VAD_THRESHOLD", "0.6"))
 ASR_WORD_TS        = os.getenv("ASR_WORD_TIMESTAMPS", "false").lower() == "true"
 ASR_COND_ON_PREV   = os.getenv("ASR_CONDITION_ON_PREV", "false").lower() == "true"
 ASR_NO_SPEECH_PROB = float(os.getenv("ASR_NO_SPEECH_PROB", "0.6"))
+ASR_CPU_THREADS    = int(os.getenv("ASR_CPU_THREADS", str(os.cpu_count() or 0)))
+ASR_WARMUP         = os.getenv("ASR_WARMUP", "true").lower() == "true"
 
 # Filtros post-ASR
 CLEAN_MIN_CHARS     = int(os.getenv("CLEAN_MIN_CHARS", "8"))
@@ -42,25 +48,40 @@ _REPLACE_MAP = {
     "olor": "dolor", "torats": "tórax", "demogramos": "hemograma",
     "neumoni": "neumonía"
 }
+# Una sola alternación (claves largas primero) para corregir en una pasada
+_REPLACE_RE = re.compile("|".join(re.escape(k) for k in sorted(_REPLACE_MAP, key=len, reverse=True)))
+
+def _sub(m: "re.Match[str]") -> str:
+    return _REPLACE_MAP[m.group(0)]
 
 _model: Optional[WhisperModel] = None
+_MODEL_LOCK = threading.Lock()
 
 def get_asr() -> WhisperModel:
-    """Inicializa (lazy) y retorna el modelo de ASR."""
+    """Inicializa (lazy, una sola vez aunque haya peticiones concurrentes) y retorna el modelo de ASR."""
     global _model
     if _model is None:
-        _model = WhisperModel(
-            ASR_MODEL_NAME,
-            compute_type=ASR_COMPUTE_TYPE
-        )
+        with _MODEL_LOCK:
+            if _model is None:
+                _model = WhisperModel(
+                    ASR_MODEL_NAME,
+                    compute_type=ASR_COMPUTE_TYPE,
+                    cpu_threads=ASR_CPU_THREADS,
+                    num_workers=1,
+                )
     return _model
 
+def warmup_asr() -> None:
+    """Carga el modelo y decodifica 1 s de silencio para que la primera petición no pague el arranque."""
+    segments, _info = get_asr().transcribe(numpy.zeros(16000, dtype=numpy.float32), language=ASR_LANGUAGE)
+    for _ in segments:  # el generador es perezoso: hay que consumirlo
+        pass
+
 def _light_normalize(text: str) -> str:
     """Normalización ligera + correcciones comunes."""
     t = (text or "").strip()
     low = t.lower()
-    for wrong, right in _REPLACE_MAP.items():
-        low = low.replace(wrong, right)
+    low = _REPLACE_RE.sub(_sub, low)
     if low:
         low = low[0].upper() + low[1:]
     return low
@@ -73,13 +94,13 @@ def _drop_bad_segment(text: str, avg_logprob: Optional[float]) -> bool:
         return True
     return False
 
-def _assign_speakers_heuristic(segments) -> List[Dict[str, Any]]:
+def _iter_turns_heuristic(segments) -> Iterator[Dict[str, Any]]:
     """
     Heurística simple (sin diarización):
     - Alterna DOCTOR/PACIENTE.
     - Cambia de hablante si hay una pausa > HEURISTIC_GAP_SEC.
+    Produce los turnos a medida que llegan los segmentos (no materializa el generador).
     """
-    out: List[Dict[str, Any]] = []
     speaker_toggle = 0  # 0=DOCTOR, 1=PACIENTE (arranca DOCTOR por defecto)
     last_end = 0.0
 
@@ -102,29 +123,24 @@ def _assign_speakers_heuristic(segments) -> List[Dict[str, Any]]:
 
         spk = "DOCTOR" if speaker_toggle == 0 else "PACIENTE"
 
-        out.append({
+        yield {
             "t0": round(start, 2),
             "t1": round(end, 2),
             "speaker": spk,
             "text": clean,
             "clinical": True
-        })
+        }
 
         last_end = end
         # Alterna por línea para simular diálogo fluido
         speaker_toggle = 1 - speaker_toggle
 
-    return out
-
-def transcribe_file(wav_path: str) -> List[Dict[str, Any]]:
-    """
-    Transcribe un WAV y devuelve turnos estilo:
-    [{t0,t1,speaker,text,clinical}]
-    * Sin diarización (whisperx/pyannote) -> heurística simple de hablante.
-    """
-    model = get_asr()
+def _assign_speakers_heuristic(segments) -> List[Dict[str, Any]]:
+    """Versión materializada de `_iter_turns_heuristic`."""
+    return list(_iter_turns_heuristic(segments))
 
-    segments, _info = model.transcribe(
+def _transcribe_segments(wav_path: str):
+    segments, _info = get_asr().transcribe(
         wav_path,
         language=ASR_LANGUAGE,
         beam_size=ASR_BEAM_SIZE,
@@ -136,15 +152,69 @@ def transcribe_file(wav_path: str) -> List[Dict[str, Any]]:
         condition_on_previous_text=ASR_COND_ON_PREV,
         no_speech_threshold=ASR_NO_SPEECH_PROB,
     )
+    return segments
 
-    out = _assign_speakers_heuristic(segments)
+_EMPTY_AUDIO_TURN = {
+    "t0": 0.0, "t1": 0.0, "speaker": "PACIENTE",
+    "text": "No se entendió el audio (silencio o ruido).",
+    "clinical": False
+}
+
+def transcribe_file(wav_path: str) -> List[Dict[str, Any]]:
+    """
+    Transcribe un WAV y devuelve turnos estilo:
+    [{t0,t1,speaker,text,clinical}]
+    * Sin diarización (whisperx/pyannote) -> heurística simple de hablante.
+    """
+    out = _assign_speakers_heuristic(_transcribe_segments(wav_path))
 
     if not out:
         # Fallback si quedó vacío
-        out = [{
-            "t0": 0.0, "t1": 0.0, "speaker": "PACIENTE",
-            "text": "No se entendió el audio (silencio o ruido).",
-            "clinical": False
-        }]
+        out = [dict(_EMPTY_AUDIO_TURN)]
+
+    return out
 
-    return out
\ No newline at end of file
+async def transcribe_stream(wav_path: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Igual que `transcribe_file` pero entrega cada turno en cuanto se decodifica.
+    La decodificación corre en un hilo; el event loop solo consume la cola,
+    así las etapas posteriores pueden solaparse con el ASR.
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Any]" = asyncio.Queue()
+    done = object()
+    # Si el consumidor se va (desconexión, aclose), el hilo deja de decodificar
+    stop = threading.Event()
+
+    def _segments():
+        for seg in _transcribe_segments(wav_path):
+            if stop.is_set():
+                return
+            yield seg
+
+    def _worker() -> None:
+        try:
+            for turn in _iter_turns_heuristic(_segments()):
+                loop.call_soon_threadsafe(queue.put_nowait, turn)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    worker = loop.run_in_executor(None, _worker)
+    emitted = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            emitted = True
+            yield item
+    finally:
+        stop.set()
+        await worker
+
+    if not emitted:
+        yield dict(_EMPTY_AUDIO_TURN)
@@ -2,19 +2,22 @@
 """Core data models for Scribe-IA API."""
 
 from typing import List, Optional
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class Turn(BaseModel):
     """Represents a single turn in a conversation transcript."""
 
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     speaker: str = Field(..., description="DOCTOR/PACIENTE/u otro")
     text: str = Field(..., min_length=1)
     t0: Optional[float] = None
     t1: Optional[float] = None
     clinical: Optional[bool] = None
 
-    @validator("speaker", pre=True, always=True)
+    @field_validator("speaker", mode="before")
+    @classmethod
     def _norm_speaker(cls, v):
         return (v or "").strip().upper()
 
@@ -26,4 +29,4 @@ class GenerateBody(BaseModel):
     patient_id: str
     practitioner_id: str
     schema_id: str = "auto"
-    transcript: List[Turn] = Field(..., min_items=1)
\ No newline at end of file
+    transcript: List[Turn] = Field(..., min_length=1)
\ No newline at end of file
@@ -3,19 +3,37 @@
 import hashlib, re
 from typing import List, Dict, Any
 
+import orjson
+
 def hash_transcript(transcript: List[Dict[str,Any]]) -> str:
-    s = " ".join([ (t.get("speaker","")+": "+t.get("text","")) for t in (transcript or []) ])
-    return hashlib.md5(s.encode("utf-8")).hexdigest()[:12]
+    # Clave de contenido: pares (speaker, text) serializados en C con orjson (sin
+    # ambigüedad de separadores) y blake2b de 128 bits (sin colisiones prácticas)
+    pairs = [(t.get("speaker") or "", t.get("text") or "") for t in transcript or ()]
+    return hashlib.blake2b(orjson.dumps(pairs, default=str), digest_size=16).hexdigest()
 
-def _first_patient_text(tx: List[Dict[str,Any]]) -> str:
-    for t in tx:
-        if (t.get("speaker","") or "").upper().startswith("PAC"):
-            return (t.get("text") or "").strip()
-    return (tx[0].get("text") or "").strip() if tx else ""
+# Palabras clave GI y signos de deshidratación (alternaciones precompiladas)
+_GI_RE = re.compile(r"diarrea|vómit|vomit|heces|deshidrat")
+_DESHID_RE = re.compile(r"\borino poco|mucosas secas|pliegue\s+cut[aá]neo")
 
 def fast_generate(transcript: List[Dict[str,Any]]) -> Dict[str,Any]:
-    low = " ".join((t.get("text") or "").lower() for t in transcript)
-    motivo = _first_patient_text(transcript)
+    # Un solo recorrido: motivo (1er turno del paciente), enfermedad actual y palabras clave
+    motivo = ""
+    parts = []
+    kw = set()
+    for t in transcript:
+        txt = (t.get("text") or "").strip()
+        if not motivo and (t.get("speaker","") or "").upper().startswith("PAC"):
+            motivo = txt
+        if not txt:
+            continue
+        parts.append(txt)
+        low = txt.lower()
+        if "gi" not in kw and _GI_RE.search(low):
+            kw.add("gi")
+        if "deshid" not in kw and _DESHID_RE.search(low):
+            kw.add("deshid")
+    if not motivo and transcript:
+        motivo = (transcript[0].get("text") or "").strip()
 
     # Diagnósticos y plan rápidos (GI demo)
     dx = []
@@ -23,9 +41,9 @@ def fast_generate(transcript: List[Dict[str,Any]]) -> Dict[str,Any]:
     recetas = []
     alertas = []
 
-    if any(k in low for k in ["diarrea","vómit","vomit","heces","deshidrat"]):
+    if "gi" in kw:
         dx = ["Gastroenteritis aguda"]
-        if re.search(r"\borino poco|mucosas secas|pliegue\s+cut[aá]neo", low):
+        if "deshid" in kw:
             dx.append("Deshidratación (sospecha)")
         ordenes = [
             "Hidratación oral con SRO en tomas fraccionadas",
@@ -42,7 +60,7 @@ def fast_generate(transcript: List[Dict[str,Any]]) -> Dict[str,Any]:
 
     return {
         "motivo_consulta": motivo or "Motivo no especificado",
-        "enfermedad_actual": " ".join((t.get("text") or "").strip() for t in transcript if (t.get("text") or "").strip()),
+        "enfermedad_actual": " ".join(parts),
         "examen_fisico": {},
         "impresion_dx": dx or ["Síndrome inespecífico"],
         "ordenes": [{"detalle": x} for x in ordenes],
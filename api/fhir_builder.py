@@ -1,9 +1,27 @@
 from datetime import datetime, timezone
 import re
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterator, Optional
+
+import orjson
 
 def _now_iso():
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+# --- Fragmentos FHIR estáticos (compartidos por referencia; el bundle solo se serializa) ---
+_ENC_CLASS = {"system":"http://terminology.hl7.org/CodeSystem/v3-ActCode","code":"AMB","display":"Ambulatory"}
+_VITAL_CATEGORY = [{"coding":[{"system":"http://terminology.hl7.org/CodeSystem/observation-category","code":"vital-signs","display":"Vital Signs"}]}]
+_BP_CODE = {"coding":[{"system":"http://loinc.org","code":"85354-9","display":"Blood pressure panel"}],"text":"Blood Pressure"}
+_BP_SYS_CODE = {"coding":[{"system":"http://loinc.org","code":"8480-6","display":"Systolic"}]}
+_BP_DIA_CODE = {"coding":[{"system":"http://loinc.org","code":"8462-4","display":"Diastolic"}]}
+_COND_CLIN = {"coding":[{"system":"http://terminology.hl7.org/CodeSystem/condition-clinical","code":"active"}]}
+_COND_VER = {"coding":[{"system":"http://terminology.hl7.org/CodeSystem/condition-ver-status","code":"unconfirmed"}]}
+_REQ_ENCOUNTER = {"method": "POST", "url": "Encounter"}
+_REQ_OBSERVATION = {"method": "POST", "url": "Observation"}
+_REQ_CONDITION = {"method": "POST", "url": "Condition"}
+_REQ_MEDREQ = {"method": "POST", "url": "MedicationRequest"}
+# Las claves literales ya quedan internadas por el compilador; lo que sí importa
+# es construir cada recurso con el mismo orden de claves (resourceType, status,
+# category, code, subject, fecha, valor) para que todos compartan layout.
 
 def _put_patient(patient_id: str):
     return {
@@ -17,90 +35,94 @@ def _put_practitioner(practitioner_id: str):
         "resource": {"resourceType": "Practitioner","id": practitioner_id,"name":[{"family":"Prueba","given":["Doctor"]}]}
     }
 
-def _post_encounter(patient_id: str, practitioner_id: str):
+def _post_encounter(patient_id: str, practitioner_id: str, now: Optional[str] = None):
+    now = now or _now_iso()
     return {
-        "request": {"method": "POST", "url": "Encounter"},
+        "request": _REQ_ENCOUNTER,
         "resource": {
             "resourceType": "Encounter",
             "status": "finished",
-            "class": {"system":"http://terminology.hl7.org/CodeSystem/v3-ActCode","code":"AMB","display":"Ambulatory"},
+            "class": _ENC_CLASS,
             "subject": {"reference": f"Patient/{patient_id}"},
             "participant": [{"individual": {"reference": f"Practitioner/{practitioner_id}"}}],
-            "period": {"start": _now_iso(), "end": _now_iso()}
+            "period": {"start": now, "end": now}
         }
     }
 
 # --- TA parsing ---
+# Primero el separador explícito (sobre, x, - o /); el espacio solo como
+# respaldo, para que "fc 88 120/80" dé 120/80 y no 88/120.
+_BP_SEP_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:sobre|[x\-/])\s*(\d+(?:\.\d+)?)", re.IGNORECASE)
+_BP_SPACE_RE = re.compile(r"(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)")
+
 def parse_blood_pressure(text: str):
     if not text: return None
-    t = str(text).lower().strip()
-    t = t.replace("sobre", "/").replace("x","/").replace("-","/")
-    t = re.sub(r"\s+", " ", t)
-    m = re.search(r"(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)", t) or re.search(r"(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)", t)
+    t = str(text)
+    m = _BP_SEP_RE.search(t) or _BP_SPACE_RE.search(t)
     if not m: return None
-    try:
-        return float(m.group(1)), float(m.group(2))
-    except: return None
+    # el regex solo captura dígitos con punto opcional: float() no puede fallar
+    return float(m.group(1)), float(m.group(2))
 
-def make_bp_observation(ta_text: str, patient_id: str):
+def make_bp_observation(ta_text: str, patient_id: str, now: Optional[str] = None):
     bp = parse_blood_pressure(ta_text)
     if not bp: return None
     sys, dia = bp
     return {
-        "request": {"method": "POST", "url": "Observation"},
+        "request": _REQ_OBSERVATION,
         "resource": {
             "resourceType": "Observation",
             "status": "final",
-            "category": [{"coding":[{"system":"http://terminology.hl7.org/CodeSystem/observation-category","code":"vital-signs","display":"Vital Signs"}]}],
-            "code": {"coding":[{"system":"http://loinc.org","code":"85354-9","display":"Blood pressure panel"}],"text":"Blood Pressure"},
+            "category": _VITAL_CATEGORY,
+            "code": _BP_CODE,
             "subject": {"reference": f"Patient/{patient_id}"},
-            "effectiveDateTime": _now_iso(),
+            "effectiveDateTime": now or _now_iso(),
             "component": [
-                {"code":{"coding":[{"system":"http://loinc.org","code":"8480-6","display":"Systolic"}]},"valueQuantity":{"value": sys,"unit":"mmHg"}},
-                {"code":{"coding":[{"system":"http://loinc.org","code":"8462-4","display":"Diastolic"}]},"valueQuantity":{"value": dia,"unit":"mmHg"}},
+                {"code":_BP_SYS_CODE,"valueQuantity":{"value": sys,"unit":"mmHg"}},
+                {"code":_BP_DIA_CODE,"valueQuantity":{"value": dia,"unit":"mmHg"}},
             ]
         }
     }
 
-def _try_observation_vital(display: str, value: Any, unit: str, patient_id: str):
+def _try_observation_vital(display: str, value: Any, unit: str, patient_id: str, now: Optional[str] = None):
     if value in (None, ""): return None
-    try:
-        v = float(str(value).replace(",", ".").split()[0])
-    except: return None
+    # guardas explícitas en vez de try/except (las entradas inválidas son frecuentes)
+    num = str(value).strip().replace(",", ".").partition(" ")[0]
+    if not num or not num.replace(".", "", 1).isdecimal(): return None
+    v = float(num)
     return {
-        "request": {"method": "POST", "url": "Observation"},
+        "request": _REQ_OBSERVATION,
         "resource": {
             "resourceType": "Observation",
             "status": "final",
-            "category": [{"coding":[{"system":"http://terminology.hl7.org/CodeSystem/observation-category","code":"vital-signs","display":"Vital Signs"}]}],
+            "category": _VITAL_CATEGORY,
             "code": {"text": display},
             "subject": {"reference": f"Patient/{patient_id}"},
-            "effectiveDateTime": _now_iso(),
+            "effectiveDateTime": now or _now_iso(),
             "valueQuantity": {"value": v, "unit": unit}
         }
     }
 
-def _condition_from_dx(text: str, patient_id: str):
+def _condition_from_dx(text: str, patient_id: str, now: Optional[str] = None):
     if not text: return None
     return {
-        "request": {"method":"POST","url":"Condition"},
+        "request": _REQ_CONDITION,
         "resource": {
             "resourceType": "Condition",
-            "clinicalStatus": {"coding":[{"system":"http://terminology.hl7.org/CodeSystem/condition-clinical","code":"active"}]},
-            "verificationStatus": {"coding":[{"system":"http://terminology.hl7.org/CodeSystem/condition-ver-status","code":"unconfirmed"}]},
+            "clinicalStatus": _COND_CLIN,
+            "verificationStatus": _COND_VER,
+            "code": {"text": text},
             "subject": {"reference": f"Patient/{patient_id}"},
-            "recordedDate": _now_iso(),
-            "code": {"text": text}
+            "recordedDate": now or _now_iso()
         }
     }
 
-def _med_request_from_text(text: str, patient_id: str, practitioner_id: str):
+def _med_request_from_text(text: str, patient_id: str, practitioner_id: str, now: Optional[str] = None):
     if not text: return None
     return {
-        "request": {"method":"POST","url":"MedicationRequest"},
+        "request": _REQ_MEDREQ,
         "resource": {
             "resourceType": "MedicationRequest",
-            "status": "active", "intent":"order", "authoredOn": _now_iso(),
+            "status": "active", "intent":"order", "authoredOn": now or _now_iso(),
             "subject": {"reference": f"Patient/{patient_id}"},
             "requester": {"reference": f"Practitioner/{practitioner_id}"},
             "medicationCodeableConcept": {"text": text},
@@ -108,25 +130,54 @@ def _med_request_from_text(text: str, patient_id: str, practitioner_id: str):
         }
     }
 
+_EMPTY: Dict[str, Any] = {}  # solo lectura
+
+# Vitales numéricos (clave en examen_fisico, display, unidad); TA va aparte
+_VITAL_SPECS = (
+    ("FC", "Heart rate", "beats/min"),
+    ("FR", "Respiratory rate", "breaths/min"),
+    ("Temp", "Body temperature", "°C"),
+    ("SatO2", "Oxygen saturation", "%"),
+)
+
+def iter_bundle_entries(patient_id: str, practitioner_id: str, json_clinico: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Entradas válidas del bundle, una a una (sin materializar la lista)."""
+    now = _now_iso()  # un único timestamp para todo el bundle
+    yield _put_patient(patient_id)
+    yield _put_practitioner(practitioner_id)
+    yield _post_encounter(patient_id, practitioner_id, now)
+
+    jc = json_clinico or _EMPTY
+    ef = jc.get("examen_fisico") or _EMPTY
+    dx_list = jc.get("impresion_dx") or ()
+    rec_list = jc.get("recetas") or ()
+    ord_list = jc.get("ordenes") or ()
+
+    if ef.get("TA"):
+        bp = make_bp_observation(ef.get("TA"), patient_id, now)
+        if bp: yield bp
+    for key,label,unit in _VITAL_SPECS:
+        ob = _try_observation_vital(label, ef.get(key), unit, patient_id, now)
+        if ob: yield ob
+
+    for dx in dx_list:
+        cond = _condition_from_dx(dx, patient_id, now)
+        if cond: yield cond
+
+    for rec in rec_list:
+        mr = _med_request_from_text(rec.get("detalle",""), patient_id, practitioner_id, now)
+        if mr: yield mr
+    for ordn in ord_list:
+        mr = _med_request_from_text(ordn.get("detalle",""), patient_id, practitioner_id, now)
+        if mr: yield mr
+
 def build_bundle(encounter_id: str, patient_id: str, practitioner_id: str, json_clinico: Dict[str, Any]):
-    entries: List[Dict[str, Any]] = []
-    entries += [_put_patient(patient_id), _put_practitioner(practitioner_id), _post_encounter(patient_id, practitioner_id)]
-
-    ef = (json_clinico or {}).get("examen_fisico", {}) or {}
-    if ef.get("TA"): entries.append(make_bp_observation(ef.get("TA"), patient_id))
-    for label,unit,key in [("Heart rate","beats/min","FC"),("Respiratory rate","breaths/min","FR"),("Body temperature","°C","Temp"),("Oxygen saturation","%","SatO2")]:
-        ob = _try_observation_vital(label, ef.get(key), unit, patient_id)
-        if ob: entries.append(ob)
-
-    for dx in (json_clinico or {}).get("impresion_dx", []) or []:
-        cond = _condition_from_dx(dx, patient_id)
-        if cond: entries.append(cond)
-
-    for rec in (json_clinico or {}).get("recetas", []) or []:
-        mr = _med_request_from_text(rec.get("detalle",""), patient_id, practitioner_id)
-        if mr: entries.append(mr)
-    for ordn in (json_clinico or {}).get("ordenes", []) or []:
-        mr = _med_request_from_text(ordn.get("detalle",""), patient_id, practitioner_id)
-        if mr: entries.append(mr)
-
-    return {"resourceType":"Bundle","type":"transaction","entry":[e for e in entries if e]}
\ No newline at end of file
+    return {"resourceType":"Bundle","type":"transaction","entry":list(iter_bundle_entries(patient_id, practitioner_id, json_clinico))}
+
+_BUNDLE_HEAD = b'{"resourceType":"Bundle","type":"transaction","entry":['
+_BUNDLE_TAIL = b"]}"
+
+def build_bundle_json(encounter_id: str, patient_id: str, practitioner_id: str, json_clinico: Dict[str, Any]) -> bytes:
+    """Bundle serializado directamente: cada entrada se vuelca a bytes una sola vez."""
+    body = b",".join(orjson.dumps(e) for e in iter_bundle_entries(patient_id, practitioner_id, json_clinico))
+    return _BUNDLE_HEAD + body + _BUNDLE_TAIL
@@ -1,22 +1,45 @@
 # api/kb.py
-import json, os, re
-from typing import Dict, Any
+import os, re, unicodedata
+from functools import lru_cache
+from typing import Dict, Any, Tuple
+
+import orjson
 
 KB_DIR = os.path.join(os.path.dirname(__file__), "kb_data")
 
+# KB estática: se lee y parsea una sola vez por proceso (solo lectura)
+_KB: Dict[str, Dict[str,Any]] = {}
+
 def _load(name: str) -> Dict[str,Any]:
-    with open(os.path.join(KB_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
-        return json.load(f)
+    data = _KB.get(name)
+    if data is None:
+        with open(os.path.join(KB_DIR, f"{name}.json"), "rb") as f:
+            data = _KB[name] = orjson.loads(f.read())
+    return data
 
-def suggest_dx_plan_meds(text_low: str, tag: str="general", pediatric: bool=False) -> Dict[str,Any]:
-    data = _load("gastro") if tag=="gastro" else _load("general")
-    res = {"dx": data[tag]["dx"], "ordenes": list(data[tag]["ordenes"]), "recetas": [], "alertas": list(data[tag]["alertas"])}
+# Fármacos a evitar con QT prolongado (NFC + minúsculas)
+_QT_DRUGS = frozenset({"ondansetrón"})
+
+_EMPTY_BUCKET: Tuple[str, ...] = ()
+
+def _norm(s: str) -> str:
+    return unicodedata.normalize("NFC", s).lower()
+
+@lru_cache(maxsize=64)
+def _suggest_cached(has_qt_prolong: bool, tag: str, pediatric: bool) -> Tuple[Any, ...]:
+    """Núcleo puro (dx, ordenes, recetas, alertas) como tuplas inmutables."""
+    data = _load("gastro" if tag=="gastro" else "general")[tag]
 
     # selecciona adulto/ped
     bucket = "pediatrico" if pediatric else "adulto"
-    recs = data[tag]["recetas"].get(bucket, [])
+    recs = data["recetas"].get(bucket) or _EMPTY_BUCKET
     # Contraindicaciones simples:
-    if "qt prolong" in text_low:
-        recs = [r for r in recs if "ondansetrón" not in r.lower()]
-    res["recetas"] = recs
-    return res
\ No newline at end of file
+    if has_qt_prolong:
+        recs = [r for r in recs if not any(d in _norm(r) for d in _QT_DRUGS)]
+    dx = data["dx"]
+    return (tuple(dx) if isinstance(dx, list) else dx), tuple(data["ordenes"]), tuple(recs), tuple(data["alertas"])
+
+def suggest_dx_plan_meds(text_low: str, tag: str="general", pediatric: bool=False) -> Dict[str,Any]:
+    dx, ordenes, recetas, alertas = _suggest_cached("qt prolong" in text_low, tag, pediatric)
+    # copias mutables para el llamador
+    return {"dx": list(dx) if isinstance(dx, tuple) else dx, "ordenes": list(ordenes), "recetas": list(recetas), "alertas": list(alertas)}
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Cachés de respuestas LLM:
+- exact_cache: mismo prompt byte a byte (solo temperature 0 o cache=True en chat()).
+- llm_cache: prompt normalizado (casi-duplicados: espacios, mayúsculas, Unicode).
+"""
+from __future__ import annotations
+import hashlib
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+from api.utils.cache import LRUCache
+
+__all__ = ["exact_cache", "exact_key", "llm_cache", "llm_key", "stats"]
+
+exact_cache = LRUCache(maxsize=1024, ttl=600)
+llm_cache = LRUCache(maxsize=500, ttl=3600)
+
+_RX_WS = re.compile(r"\s+")
+
+def _norm(text: str) -> str:
+    # Transcripciones ASR repetidas suelen diferir solo en espacios/mayúsculas
+    return _RX_WS.sub(" ", unicodedata.normalize("NFC", text)).strip().casefold()
+
+def exact_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: Optional[int],
+    json_mode: bool,
+) -> str:
+    b = orjson.dumps([model, temperature, max_tokens, json_mode, messages])
+    return hashlib.blake2b(b, digest_size=16).hexdigest()
+
+def llm_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: Optional[int],
+    json_mode: bool,
+) -> str:
+    norm = [(m.get("role"), _norm(m.get("content") or "")) for m in messages]
+    b = orjson.dumps([model, temperature, max_tokens, json_mode, norm])
+    return hashlib.blake2b(b, digest_size=16).hexdigest()
+
+def stats() -> Dict[str, Any]:
+    return {"exact": exact_cache.stats(), "normalized": llm_cache.stats()}
@@ -6,27 +6,62 @@ This is the simplified main file that orchestrates all routes.
 Business logic has been moved to services, routes, and utils modules.
 """
 
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from api.config import settings
+from api.core.dependencies import ASR_WARMUP, warmup_asr
+from api.utils.http import close_http_client, get_http_client
 
 # Import routers
 from api.routes import health, ingest, nlp, fhir, knowledge, pubmed, cds, agent
 from api.routes import print as print_routes
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque/parada: TMP_DIR, cliente httpx compartido y warmup del ASR."""
+    # TMP_DIR una vez (los uploads ya no lo comprueban por request)
+    os.makedirs(settings.TMP_DIR, exist_ok=True)
+    # Un solo AsyncClient con pool para LLM/PubMed/FHIR, creado antes de la primera
+    # petición; los servicios lo obtienen con get_http_client() (mismo objeto)
+    app.state.http = get_http_client()
+    # Precarga opcional del modelo ASR fuera del event loop: si falla (descarga,
+    # memoria...) el resto de la API arranca igual y /ingest lo carga en el primer uso
+    if ASR_WARMUP:
+        try:
+            await asyncio.to_thread(warmup_asr)
+        except Exception:
+            logger.exception("ASR warmup failed; model will load lazily on first /ingest")
+    try:
+        yield
+    finally:
+        await close_http_client()
+
+
 # Create FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="Scribe IA API",
     version="3.0.0",
-    description="Medical transcription and clinical decision support API"
+    description="Medical transcription and clinical decision support API",
+    # orjson serializa los bundles FHIR (dicts anidados) mucho más rápido que json
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS
-allow_origins = settings.CORS_ALLOWED if isinstance(settings.CORS_ALLOWED, list) else [settings.CORS_ALLOWED]
+# CORS_ALLOWED ya es una tupla normalizada al cargar settings
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allow_origins,
+    allow_origins=settings.CORS_ALLOWED,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -51,5 +86,9 @@ if __name__ == "__main__":
         host=settings.API_HOST,
         port=settings.API_PORT,
         log_level=settings.LOG_LEVEL,
-        reload=False
+        reload=False,
+        loop="uvloop",
+        http="httptools",
+        workers=max(1, settings.API_WORKERS),
+        access_log=settings.ACCESS_LOG,
     )
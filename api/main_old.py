@@ -2,20 +2,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import copy
 import os
 import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 from api.rule_extract import extract_from_transcript, dedupe_letters
 from api.fast_engine import fast_generate, hash_transcript
 
-import httpx
 from fastapi import FastAPI, UploadFile, File, Query, Body, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field, validator
 
 from api.config import (
-    API_HOST, API_PORT, TMP_DIR, FHIR_BASE_URL, CORS_ALLOWED, KNOWLEDGE_DIR
+    API_HOST, API_PORT, TMP_DIR, FHIR_BASE_URL, CORS_ALLOWED, KNOWLEDGE_DIR,
+    VITALS_PATTERNS,
 )
 from api.deps_asr import transcribe_file
 from api.template_router import pick_schema_from_transcript  # async
@@ -24,7 +27,12 @@ from api.nlp_pipeline import generate_structured_json
 from api.clinical_cleanup import cleanup_json
 from api.fhir_builder import build_bundle
 from api.augment import augment_with_pubmed
-from api.pubmed import pubmed_search, pubmed_ingest_to_files
+from api.pubmed import pubmed_search, pubmed_ingest_to_files, pubmed_request_scope
+from api.utils.responses import json_response
+from api.utils.keywords import compile_keywords
+from api.utils.cache import LRUCache
+from api.utils.files import safe_filename
+from api.utils.http import get_http_client, close_http_client
 
 # Intentar cargar CDS nuevo
 try:
@@ -34,7 +42,8 @@ except Exception:
     from api.cds import suggest_analgesic as suggest_cds, build_context_from_json  # type: ignore
     _CDS_ENTRY = "suggest_analgesic"
 
-app = FastAPI(title="Scribe IA API", version="2.3.0")
+# orjson para todas las respuestas (json_clinico + bundle + CDS son payloads grandes)
+app = FastAPI(title="Scribe IA API", version="2.3.0", default_response_class=ORJSONResponse)
 
 allow_origins = CORS_ALLOWED if isinstance(CORS_ALLOWED, list) else [CORS_ALLOWED]
 app.add_middleware(
@@ -63,91 +72,188 @@ class GenerateBody(BaseModel):
     schema_id: str = "auto"
     transcript: List[Turn] = Field(..., min_items=1)
 
-_VITALS_RX = re.compile(
-    r"""
-    (?:TA[:\s]*([\d]{2,3}\s*[\/]\s*[\d]{2,3}))?
-    .*?(?:FC[:\s]*([\d]{2,3}))?
-    .*?(?:FR[:\s]*([\d]{2,3}))?
-    .*?(?:Temp(?:eratura)?[:\s]*([\d]{2}(?:[.,]\d{1})?))?
-    .*?(?:SatO2?[:\s]*([\d]{2,3}))?
-    """,
-    re.IGNORECASE | re.DOTALL | re.VERBOSE
-)
+# Un patrón por etiqueta (api.config.constants.VITALS_PATTERNS): cada .search es
+# lineal y no hay .*? entre grupos que retroceda sobre bloques largos
+_VITALS_RX = tuple(VITALS_PATTERNS.items())
 
 def _join_texts(turns: List[Dict[str, Any]]) -> str:
-    return " ".join([ (t.get("text") or "").strip() for t in (turns or []) if (t.get("text") or "").strip() ])
-
-def _pick_first_text(turns: List[Dict[str, Any]], speaker="PACIENTE") -> str:
+    parts: List[str] = []
+    append = parts.append
     for t in (turns or []):
-        if (t.get("speaker","") or "").upper() == speaker and t.get("text"):
-            return t["text"].strip()
-    return ""
+        if (s := (t.get("text") or "").strip()):
+            append(s)
+    return " ".join(parts)
+
+def _joined_views(turns: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """Un solo recorrido: (texto unido con espacios, texto unido con " . " en minúsculas para reglas)."""
+    parts = [txt for txt in ((t.get("text") or "").strip() for t in (turns or [])) if txt]
+    return " ".join(parts), " . ".join(parts).lower()
+
+# Artefactos derivados del transcript (schema, vitales, reglas) por hash_transcript
+_DERIVED = LRUCache(maxsize=1024)
+
+def _memo(kind: str, h: Optional[str], fn, *args):
+    """Memoiza fn(*args) bajo (kind, h); devuelve copia para que el llamador pueda mutarla."""
+    if h is None:
+        return fn(*args)
+    key = (kind, h)
+    hit = _DERIVED.get(key)
+    if hit is None:
+        hit = fn(*args)
+        _DERIVED.put(key, hit)
+    return copy.deepcopy(hit)
+
+def _merge_obj(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fusiona src dentro de dst in-place, sin pisar valores no vacíos.
+    Iterativo (pila de pares) y sin copiar cada nivel.
+    """
+    root = dst if isinstance(dst, dict) else {}
+    stack = [(root, src or {})]
+    while stack:
+        d, s = stack.pop()
+        for k, v in s.items():
+            if isinstance(v, dict):
+                child = d.get(k)
+                if not isinstance(child, dict):
+                    if child:
+                        continue  # ya hay un valor no-dict: no se pisa
+                    child = d[k] = {}
+                stack.append((child, v))
+            elif not d.get(k):
+                d[k] = v
+    return root
+
+# --------- CDS ---------
+# Fallback analgésico: una sola pasada sobre texto detecta riesgo GI y AAS
+_RX_ANALGESIC = re.compile(
+    r"(?P<gi>ulcer|sangrado|gastritis|anticoagul|warfarin|acenocumar)"
+    r"|(?P<aas>\b(?:aspirina|aas|ácido\s+acetilsalicílico)\b)",
+    re.I,
+)
+
+def _normalize_suggestions(sugs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Lleva las sugerencias del motor CDS al formato que consume el front."""
+    out: List[Dict[str, Any]] = []
+    append = out.append
+    for s in (sugs or []):
+        if not isinstance(s, dict): continue
+        # cada campo se lee una sola vez (antes proposed/medication/evidence se repetían)
+        get = s.get
+        proposed = get("proposed")
+        med = get("medication")
+        typ = get("type") or "info"
+        msg = (get("message") or proposed or get("text") or get("guideline") or "").strip()
+        if med and (instr := get("instructions")):
+            msg = f"{med}: {instr}".strip(": ")
+            typ = "medication"
+        if msg:
+            pmids = get("pmids") or []
+            if not pmids:
+                ev = get("evidence")
+                if isinstance(ev, list):
+                    pmids = [str(e["pmid"]) for e in ev if isinstance(e, dict) and e.get("pmid")]
+            append({
+                "id": get("id") or get("code") or "",
+                "type": typ,
+                "message": msg,
+                "proposed": proposed or med or "",
+                "current": get("current") or "",
+                "actions": get("actions") or [],
+                "rationale": get("rationale") or "",
+                "pmids": pmids,
+                "safety_notes": get("safety_notes", [])
+            })
+    return out
+
+# Disparadores de schema/impresión: una pasada sobre el texto en minúsculas
+_SCAN_SCHEMA = compile_keywords({
+    "diarrea": "GI", "vómit": "GI", "vomit": "GI", "gastroenter": "GI", "heces": "GI", "deshidrat": "GI",
+    "tos": "RESP", "disnea": "RESP", "fiebre": "RESP", "neumon": "RESP",
+    "saturación": "SAT", "sato2": "SAT",
+    "dolor en el pecho": "TORAX", "dolor torácico": "TORAX", "opresión torácica": "OPRESION",
+})
 
 def _guess_schema_from_text(txt: str) -> str:
-    low = (txt or "").lower()
-    if any(k in low for k in ["diarrea", "vómit", "vomit", "gastroenter", "heces", "deshidrat"]):
+    hits = _SCAN_SCHEMA((txt or "").lower())
+    if "GI" in hits:
         return "gastroenteritis_aguda"
-    if any(k in low for k in ["tos", "disnea", "fiebre", "neumon", "saturación", "sato2"]):
+    if "RESP" in hits or "SAT" in hits:
         return "respiratoria_aguda"
-    if any(k in low for k in ["dolor en el pecho", "dolor torácico", "opresión torácica"]):
+    if "TORAX" in hits or "OPRESION" in hits:
         return "dolor_toracico"
     return "consulta_general"
 
 def _extract_vitals(block_text: str):
-    m = _VITALS_RX.search(block_text or "")
-    if not m:
-        return {}
-    TA, FC, FR, Temp, Sat = m.groups()
+    txt = block_text or ""
     out: Dict[str, Any] = {}
-    if TA:   out["TA"]   = TA.replace(" ", "")
-    if FC:   out["FC"]   = FC
-    if FR:   out["FR"]   = FR
-    if Temp: out["Temp"] = Temp.replace(",", ".")
-    if Sat:  out["SatO2"]= Sat
+    for key, rx in _VITALS_RX:
+        m = rx.search(txt)
+        if m:
+            out[key] = m.group(1)
+    if "TA" in out:
+        out["TA"] = out["TA"].replace(" ", "")
+    if "Temp" in out:
+        out["Temp"] = out["Temp"].replace(",", ".")
     return out
 
-def _heuristic_json(transcript: list) -> dict:
-    turns = transcript or []
-    texto_total = _join_texts(turns)
+_RX_EXAMEN = re.compile(r"(signos\s+vitales|signos:|examen[: ]|exploraci[oó]n)", re.I)
+_RX_HALLAZGO = re.compile(r"(mucosas|abdomen|crepitantes|edema|pliegue|yugular|hepatomegalia|ruidos)", re.I)
+
+_IC_RX = re.compile(
+    r"(?P<ortopnea>\b(?:ortopnea|dos almohadas|al\ acostarse|parox[ií]stica nocturna|me despert[eé] ahog[aá]ndome)\b)"
+    r"|(?P<edema>\b(?:edema|hinchaz[oó]n)(?=.*(?:piernas|tobillos|maleolar)\b))"
+    r"|(?P<iy>\bingurgitaci[oó]n yugular|\bIY\b)"
+    r"|(?P<crep>\bcrepitantes\b)"
+    r"|(?P<s3>\bS3\b)"
+    r"|(?P<kilo>\bsubido\b(?=.*\bkilo))"
+    r"|(?P<disnea>\bfalta de aire|disnea|me cuesta respirar\b)"
+)
 
-    motivo = _pick_first_text(turns, "PACIENTE") or "Motivo no especificado."
-    ea_lines = [ (t.get("text") or "").strip()
-                 for t in turns if (t.get("speaker","").upper()=="PACIENTE" and (t.get("text") or "").strip()) ]
-    enfermedad_actual = "\n".join(ea_lines) if ea_lines else motivo
+def _heuristic_json(transcript: list, texto_total: Optional[str] = None, h: Optional[str] = None) -> dict:
+    turns = transcript or []
 
+    # Una sola pasada por los turnos: texto unido, motivo, EA, bloque de examen y hallazgos
+    parts: List[str] = []
+    ea_lines: List[str] = []
+    motivo: Optional[str] = None
     examen_block = ""
+    hall_lines: List[str] = []
     for t in turns:
-        tx = (t.get("text") or "")
-        if re.search(r"(signos\s+vitales|signos:|examen[: ]|exploraci[oó]n)", tx, re.I):
+        tx = t.get("text") or ""
+        st = tx.strip()
+        if st:
+            parts.append(st)
+        if (t.get("speaker") or "").upper() == "PACIENTE":
+            if motivo is None and tx:
+                motivo = st
+            if st:
+                ea_lines.append(st)
+        if not examen_block and _RX_EXAMEN.search(tx):
             examen_block = tx
-            break
-    vitals = _extract_vitals(examen_block or texto_total)
+        if _RX_HALLAZGO.search(tx):
+            hall_lines.append(tx)
+    if texto_total is None:
+        texto_total = " ".join(parts)
 
-    hall = None
-    for t in turns:
-        tx = (t.get("text") or "")
-        if re.search(r"(mucosas|abdomen|crepitantes|edema|pliegue|yugular|hepatomegalia|ruidos)", tx, re.I):
-            hall = tx if not hall else f"{hall}\n{tx}"
+    motivo = motivo or "Motivo no especificado."
+    enfermedad_actual = "\n".join(ea_lines) if ea_lines else motivo
+    vitals = _memo("vitals", h, _extract_vitals, examen_block or texto_total)
+    hall = "\n".join(hall_lines) or None
 
     imp: List[str] = []
     low = texto_total.lower()
-    # Heurística IC
-    ic_hits = 0
-    for rx in [
-        r"\b(ortopnea|dos almohadas|al\ acostarse|parox[ií]stica nocturna|me despert[eé] ahog[aá]ndome)\b",
-        r"\b(edema|hinchaz[oó]n).*(piernas|tobillos|maleolar)\b",
-        r"\bingurgitaci[oó]n yugular|\bIY\b",
-        r"\bcrepitantes\b",
-        r"\bS3\b",
-        r"\bsubido\b.*\bkilo",
-    ]:
-        if re.search(rx, low): ic_hits += 1
-
-    if ic_hits >= 2 and re.search(r"\bfalta de aire|disnea|me cuesta respirar\b", low):
+    hits = _SCAN_SCHEMA(low)
+    # Heurística IC: una pasada; los criterios con cola (.*) van en lookahead para
+    # no consumir texto que otro criterio necesita
+    found = {m.lastgroup for m in _IC_RX.finditer(low)}
+    ic_hits = len(found - {"disnea"})
+
+    if ic_hits >= 2 and "disnea" in found:
         imp.append("Insuficiencia cardiaca aguda descompensada (probable)")
-    elif any(k in low for k in ["tos","disnea","fiebre","neumon"]):
+    elif "RESP" in hits:
         imp.append("Infección respiratoria (evaluar)")
-    elif any(k in low for k in ["dolor en el pecho","dolor torácico"]):
+    elif "TORAX" in hits:
         imp.append("Dolor torácico (estratificar riesgo)")
     else:
         imp.append("Síndrome inespecífico, requiere aclaración diagnóstica")
@@ -190,10 +296,16 @@ def _heuristic_json(transcript: list) -> dict:
         "revision_sistemas": {}
     }
 
+@app.on_event("shutdown")
+async def _close_http():
+    await close_http_client()
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "cds_entry": _CDS_ENTRY}
 
+_UPLOAD_CHUNK = 1 << 20
+
 @app.post("/ingest/upload")
 async def ingest_upload(
     encounter_id: str = Query(..., description="ID del encuentro"),
@@ -202,14 +314,18 @@ async def ingest_upload(
     try:
         os.makedirs(TMP_DIR, exist_ok=True)
         path = os.path.join(TMP_DIR, f"{encounter_id}.wav")
-        raw = await wav.read()
+        # copia por bloques de 1 MiB: RSS constante sin importar el tamaño del WAV;
+        # la escritura a disco va a un hilo para no frenar el event loop
         with open(path, "wb") as f:
-            f.write(raw)
+            while chunk := await wav.read(_UPLOAD_CHUNK):
+                await asyncio.to_thread(f.write, chunk)
         transcript = transcribe_file(path)  # -> List[dict]
         return {"encounter_id": encounter_id, "transcript": transcript, "stored_wav": path}
     except Exception as e:
         raise HTTPException(500, f"ingest failed: {e}")
 
+_RULE_SECTIONS = ("antecedentes", "revision_sistemas", "examen_fisico")
+
 @app.post("/nlp/generate")
 async def nlp_generate(body: GenerateBody):
     result: Dict[str, Any] = {
@@ -223,8 +339,9 @@ async def nlp_generate(body: GenerateBody):
     }
 
     try:
-        payload = body.model_dump()
-        transcript = payload.get("transcript") or []
+        # el body ya fue validado: __dict__ evita que model_dump recorra los campos otra vez
+        payload = body.__dict__
+        transcript = [dict(t.__dict__) for t in body.transcript]
     except Exception as e:
         raise HTTPException(400, f"generate failed (input-invalid): {e}")
 
@@ -235,6 +352,10 @@ async def nlp_generate(body: GenerateBody):
     except Exception as e:
         result["_debug"]["warn_norm_transcript"] = f"{type(e).__name__}: {e}"
 
+    # texto unido una sola vez por request (router, fallback y reglas)
+    joined, joined_rules = _joined_views(transcript)
+    h = hash_transcript(transcript)
+
     # 2) schema
     try:
         schema_used = payload.get("schema_id") or "auto"
@@ -244,13 +365,13 @@ async def nlp_generate(body: GenerateBody):
             except Exception:
                 pick = None
             if not pick or not pick.get("schema_id"):
-                pick = {"schema_id": _guess_schema_from_text(_join_texts(transcript))}
+                pick = {"schema_id": _memo("schema", h, _guess_schema_from_text, joined)}
             result["router_debug"] = pick
             schema_used = (pick or {}).get("schema_id", "consulta_general")
         result["schema_used"] = schema_used
     except Exception as e:
         result["_debug"]["warn_router"] = f"{type(e).__name__}: {e}"
-        schema_used = _guess_schema_from_text(_join_texts(transcript)) or "consulta_general"
+        schema_used = _memo("schema", h, _guess_schema_from_text, joined) or "consulta_general"
         result["schema_used"] = schema_used
 
     # 3) JSON clínico con LLM (+ fallback)
@@ -265,7 +386,7 @@ async def nlp_generate(body: GenerateBody):
         result["json_clinico"] = json_clinico
     except Exception as e:
         result["_debug"]["err_llm"] = f"{type(e).__name__}: {e}"
-        result["json_clinico"] = _heuristic_json(transcript)
+        result["json_clinico"] = _heuristic_json(transcript, joined, h)
 
     # 4) limpieza clínica
     try:
@@ -275,83 +396,67 @@ async def nlp_generate(body: GenerateBody):
 
     # 4.1) enriquecer con reglas (antecedentes/ROS/EF/alertas) sin pisar
     try:
-        heur = extract_from_transcript(transcript)
         jc = result["json_clinico"] = result.get("json_clinico") or {}
+        # solo se extraen las secciones que el LLM dejó vacías; alertas siempre
+        missing = tuple(k for k in _RULE_SECTIONS if not jc.get(k))
+        sections = missing + ("alertas",)
+        heur = _memo("rules:" + ",".join(missing), h, extract_from_transcript, transcript, joined_rules, sections)
 
-        def _merge_obj(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
-            out = dict(dst or {})
-            for k,v in (src or {}).items():
-                if isinstance(v, dict):
-                    out[k] = _merge_obj(out.get(k, {}), v)
-                else:
-                    out[k] = v if k not in out or not out[k] else out[k]
-            return out
-
-        jc["antecedentes"] = _merge_obj(jc.get("antecedentes", {}), heur.get("antecedentes", {}))
-        jc["revision_sistemas"] = _merge_obj(jc.get("revision_sistemas", {}), heur.get("revision_sistemas", {}))
-        jc["examen_fisico"] = _merge_obj(jc.get("examen_fisico", {}), heur.get("examen_fisico", {}))
+        for k in missing:
+            jc[k] = _merge_obj(jc.get(k, {}), heur.get(k, {}))
         if heur.get("alertas"):
-            jc["alertas"] = sorted(list(set((jc.get("alertas") or []) + heur["alertas"])))
+            jc["alertas"] = list(dict.fromkeys((jc.get("alertas") or []) + heur["alertas"]))
     except Exception as e:
         result["_debug"]["warn_rules_enrich"] = f"{type(e).__name__}: {e}"
 
-    # 5) augment (PubMed)
-    try:
-        result["augment"] = augment_with_pubmed(
-            result["json_clinico"], schema_used=schema_used, top_k=12
+    # 5-7) augment (PubMed), FHIR y CDS son independientes dado json_clinico
+    # (todos solo lo leen): se lanzan a la vez. augment/FHIR son sync -> hilo.
+    jc = result["json_clinico"]
+
+    async def _cds() -> List[Dict[str, Any]]:
+        ctx = build_context_from_json(jc)
+        ctx["_schema"] = schema_used
+        return await suggest_cds(ctx, use_pubmed=True, pubmed_max=5)
+
+    # una caché PubMed por request: búsquedas repetidas salen una sola vez
+    with pubmed_request_scope():
+        augment, bundle, raw_sugs = await asyncio.gather(
+            asyncio.to_thread(augment_with_pubmed, jc, schema_used=schema_used, top_k=12),
+            asyncio.to_thread(
+                build_bundle,
+                encounter_id=payload["encounter_id"],
+                patient_id=payload["patient_id"],
+                practitioner_id=payload["practitioner_id"],
+                json_clinico=jc,
+            ),
+            _cds(),
+            return_exceptions=True,
         )
-    except Exception as e:
-        result["_debug"]["warn_augment"] = f"{type(e).__name__}: {e}"
+
+    # 5) augment
+    if isinstance(augment, BaseException):
+        result["_debug"]["warn_augment"] = f"{type(augment).__name__}: {augment}"
+    else:
+        result["augment"] = augment
 
     # 6) FHIR
-    try:
-        result["fhir_bundle"] = build_bundle(
-            encounter_id=payload["encounter_id"],
-            patient_id=payload["patient_id"],
-            practitioner_id=payload["practitioner_id"],
-            json_clinico=result["json_clinico"],
-        )
-    except Exception as e:
-        result["_debug"]["warn_fhir_bundle"] = f"{type(e).__name__}: {e}"
+    if isinstance(bundle, BaseException):
+        result["_debug"]["warn_fhir_bundle"] = f"{type(bundle).__name__}: {bundle}"
         result["fhir_bundle"] = {}
+    else:
+        result["fhir_bundle"] = bundle
 
     # 7) CDS
     try:
-        ctx = build_context_from_json(result["json_clinico"])
-        ctx["_schema"] = schema_used
-        raw_sugs = await suggest_cds(ctx, use_pubmed=True, pubmed_max=5)
-
-        def _normalize(sugs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-            out: List[Dict[str, Any]] = []
-            for s in (sugs or []):
-                if not isinstance(s, dict): continue
-                typ = s.get("type") or "info"
-                msg = (s.get("message") or s.get("proposed") or s.get("text") or s.get("guideline") or "").strip()
-                if s.get("medication") and s.get("instructions"):
-                    msg = f"{s.get('medication')}: {s.get('instructions')}".strip(": ")
-                    typ = "medication"
-                if msg:
-                    pmids = s.get("pmids") or []
-                    if not pmids and isinstance(s.get("evidence"), list):
-                        pmids = [str(e.get("pmid")) for e in s["evidence"] if isinstance(e, dict) and e.get("pmid")]
-                    out.append({
-                        "id": s.get("id") or s.get("code") or "",
-                        "type": typ,
-                        "message": msg,
-                        "proposed": s.get("proposed") or s.get("medication") or "",
-                        "current": s.get("current") or "",
-                        "actions": s.get("actions") or [],
-                        "rationale": s.get("rationale") or "",
-                        "pmids": pmids,
-                        "safety_notes": s.get("safety_notes", [])
-                    })
-            return out
-        result["cds_suggestions"] = _normalize(raw_sugs or [])
+        if isinstance(raw_sugs, BaseException):
+            raise raw_sugs
+        result["cds_suggestions"] = _normalize_suggestions(raw_sugs or [])
     except Exception as e:
         result["_debug"]["warn_cds"] = f"{type(e).__name__}: {e}"
         result["cds_suggestions"] = []
 
-    return result
+    # bytes directos: sin jsonable_encoder y con fallback para set/Decimal/pydantic
+    return json_response(result)
 
 @app.post("/nlp/augment")
 async def nlp_augment(payload: Dict[str, Any] = Body(...)):
@@ -365,15 +470,15 @@ async def nlp_augment(payload: Dict[str, Any] = Body(...)):
 @app.post("/fhir/push")
 async def fhir_push(bundle: Dict[str, Any] = Body(...)):
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post(
-                FHIR_BASE_URL,
-                json=bundle,
-                headers={"Content-Type": "application/fhir+json"},
-            )
+        r = await get_http_client().post(
+            FHIR_BASE_URL,
+            json=bundle,
+            headers={"Content-Type": "application/fhir+json"},
+            timeout=60,
+        )
         if r.status_code >= 300:
             raise HTTPException(r.status_code, f"FHIR error: {r.text}")
-        return {"status": "ok", "response": r.json()}
+        return ORJSONResponse({"status": "ok", "response": r.json()})
     except HTTPException:
         raise
     except Exception as e:
@@ -383,11 +488,17 @@ async def fhir_push(bundle: Dict[str, Any] = Body(...)):
 async def knowledge_list():
     try:
         os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
-        files = [f for f in os.listdir(KNOWLEDGE_DIR) if not f.startswith(".")]
+        # scandir: iterador perezoso y tipo de entrada ya viene del syscall
+        with os.scandir(KNOWLEDGE_DIR) as it:
+            files = [e.name for e in it if not e.name.startswith(".") and e.is_file()]
         return {"count": len(files), "files": files}
     except Exception as e:
         raise HTTPException(500, f"knowledge list failed: {e}")
 
+def _write_text(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
 @app.post("/knowledge/upsert")
 async def knowledge_upsert(
     name: str = Query(..., description="nombre del archivo en KNOWLEDGE_DIR"),
@@ -395,10 +506,11 @@ async def knowledge_upsert(
 ):
     try:
         os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
-        path = os.path.join(KNOWLEDGE_DIR, name)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(content)
+        path = os.path.join(KNOWLEDGE_DIR, safe_filename(name))
+        await asyncio.to_thread(_write_text, path, content)
         return {"status": "ok", "path": path}
+    except ValueError as e:
+        raise HTTPException(400, f"knowledge upsert failed: {e}")
     except Exception as e:
         raise HTTPException(500, f"knowledge upsert failed: {e}")
 
@@ -476,8 +588,10 @@ async def cds_suggest(payload: Dict[str, Any] = Body(...)):
 
         # Fallback analgésico: Paracetamol si AAS y riesgo GI
         try:
-            riesgo_gi = bool(re.search(r"ulcer|sangrado|gastritis|anticoagul|warfarin|acenocumar", ctx.get("texto",""), re.I))
-            prescribio_aas = bool(re.search(r"\b(aspirina|aas|ácido\s+acetilsalicílico)\b", ctx.get("texto",""), re.I))
+            texto = ctx.get("texto","")
+            tags = {m.lastgroup for m in _RX_ANALGESIC.finditer(texto)}
+            riesgo_gi = "gi" in tags
+            prescribio_aas = "aas" in tags
             if prescribio_aas:
                 sugs.append({
                     "id": "SUG-analgesic-001",
@@ -490,7 +604,7 @@ async def cds_suggest(payload: Dict[str, Any] = Body(...)):
                     "pmids": ["23336517","31562798"],
                     "safety_notes": ["500–1000 mg c/6–8 h (máx. 3–4 g/día). Ajustar en hepatopatía."]
                 })
-            elif ("fiebre" in ctx.get("texto","") or "dolor" in ctx.get("texto","")) and riesgo_gi:
+            elif ("fiebre" in texto or "dolor" in texto) and riesgo_gi:
                 sugs.append({
                     "id": "SUG-analgesic-002",
                     "type": "medication",
@@ -505,7 +619,7 @@ async def cds_suggest(payload: Dict[str, Any] = Body(...)):
         except Exception:
             pass
 
-        return {"suggestions": sugs, "ctx_used": ctx}
+        return json_response({"suggestions": sugs, "ctx_used": ctx})
     except Exception as e:
         raise HTTPException(400, detail=f"cds failed: {e}")
 
@@ -513,158 +627,27 @@ async def cds_suggest(payload: Dict[str, Any] = Body(...)):
 from api.printouts import router as print_router
 app.include_router(print_router, prefix="/print", tags=["print"])
 
-CACHE: Dict[str, Dict[str,Any]] = {}
+# Acotado: antes era un dict sin límite (crecía con cada transcript distinto)
+CACHE = LRUCache(maxsize=1024)
+# Bundle por (hash, encounter, patient, practitioner): los reintentos no reconstruyen FHIR
+BUNDLE_CACHE = LRUCache(maxsize=1024)
 
 @app.post("/nlp/fast_generate")
 async def nlp_fast_generate(body: GenerateBody):
-    tx = [t.model_dump() if hasattr(t, "model_dump") else dict(t) for t in body.transcript]
+    tx = [dict(t.__dict__) for t in body.transcript]
     key = hash_transcript(tx)
-    if key in CACHE:
-        return {"json_clinico": CACHE[key], "schema_used": "fastpath"}
-    jc = fast_generate(tx)
-    CACHE[key] = jc
-    bundle = build_bundle(body.encounter_id, body.patient_id, body.practitioner_id, jc)
-    return {"json_clinico": jc, "fhir_bundle": bundle, "schema_used": "fastpath"}
-
-# api/postprocess.py
-import re
-from datetime import datetime
-
-MAX_EA = 380  # recorte de Enfermedad Actual si viene muy larga
-
-def _lower(s): return (s or "").lower()
-
-def compact_enfermedad_actual(ea):
-    if not ea:
-        return ea
-    if isinstance(ea, dict):
-        return ea
-    s = re.sub(r"\s+", " ", str(ea)).strip()
-    if len(s) <= MAX_EA:
-        return s
-    parts = re.split(r"(?<=\.)\s+", s)
-    out = []
-    for p in parts:
-        out.append(p)
-        if len(" ".join(out)) > MAX_EA:
-            break
-    clipped = " ".join(out).strip()
-    return (clipped[:MAX_EA-1].rstrip() + "…") if len(clipped) > MAX_EA else clipped
-
-def extract_rules_from_transcript(transcript):
-    T = " . ".join([_lower(t.get("text","")) for t in (transcript or [])])
-
-    ant = {
-        "personales": [], "patologicos": [], "quirurgicos": [],
-        "farmacologicos": [], "alergias": [], "gineco_obstetricos": [],
-        "toxicos_habitos": [], "familiares": [], "psicosociales": []
-    }
-    ros = {
-        "general": [], "respiratorio": [], "cardiovascular": [], "digestivo": [],
-        "genitourinario": [], "neurologico": [], "dermatologico": [], "musculoesqueletico": []
-    }
-    ef = {}
-
-    # antecedentes / fármacos / hábitos
-    if "hipertens" in T:
-        ant["personales"].append("Hipertensión arterial")
-        ant["patologicos"].append("Hipertensión arterial")
-    if "cardiopat" in T:
-        ant["personales"].append("Cardiopatía")
-
-    if "losart" in T:     ant["farmacologicos"].append("Losartán 50 mg/día")
-    if "furosemida" in T: ant["farmacologicos"].append("Furosemida 20 mg mañana (olvidos esporádicos)")
-    if "ibuprofeno" in T: ant["farmacologicos"].append("Ibuprofeno (reciente)")
-
-    if "sin alerg" in T or "no alerg" in T:
-        ant["alergias"].append("Sin alergias conocidas")
-
-    if "no fumo" in T or "no fuma" in T:
-        ant["toxicos_habitos"].append("No fuma")
-    if "sal" in T and ("más" in T or "mas" in T or "alta" in T):
-        ant["toxicos_habitos"].append("Ingesta de sal aumentada")
-
-    # ROS
-    if any(k in T for k in ["disnea","falta de aire","ahog"]):
-        ros["respiratorio"].extend(["Disnea de esfuerzo","Ortopnea","Disnea paroxística nocturna"])
-    if "tos" in T and "seca" in T:
-        ros["respiratorio"].append("Tos seca")
-    if any(k in T for k in ["palpitaciones","rápido","rapido"]):
-        ros["cardiovascular"].append("Palpitaciones")
-    if any(k in T for k in ["edema","hinchazón","hinchazon","tobillos"]):
-        ros["musculoesqueletico"].append("Edema maleolar")
-    if any(k in T for k in ["orino menos","orino poco","diuresis"]):
-        ros["genitourinario"].append("Diuresis disminuida")
-    if any(k in T for k in ["aumento de peso","subido","3 kilos"]):
-        ros["general"].append("Aumento de peso reciente")
-
-    # EF
-    m = re.search(r"ta\s*(\d{2,3}\s*/\s*\d{2,3})", T, re.I)
-    if m: ef["TA"] = m.group(1).replace(" ","")
-    m = re.search(r"fc\s*(\d{2,3})", T, re.I)
-    if m: ef["FC"] = m.group(1)
-    m = re.search(r"fr\s*(\d{2,3})", T, re.I)
-    if m: ef["FR"] = m.group(1)
-    m = re.search(r"(\b3[5-9](?:[.,]\d+)?)\s*°?\s*c", T, re.I)
-    if m: ef["Temp"] = m.group(1).replace(",","." )
-    m = re.search(r"sato2\s*(\d{2,3})\s*%", T, re.I)
-    if m: ef["SatO2"] = m.group(1)
-
-    hall = []
-    if "crepitantes" in T: hall.append("Crepitantes bibasales")
-    if "ingurgit" in T:    hall.append("Ingurgitación yugular +")
-    if "hepatomeg" in T:   hall.append("Hepatomegalia leve")
-    if "edema" in T:       hall.append("Edema blando maleolar bilateral +/++")
-    if "s3" in T:          hall.append("S3 audible")
-    if "sin soplos" in T:  hall.append("Sin soplos evidentes")
-    if hall:
-        ef["hallazgos"] = ", ".join(hall) + "."
-
-    # dedup/limpieza
-    for k in ant:
-        if isinstance(ant[k], list):
-            ant[k] = sorted(list({x.strip() for x in ant[k] if x.strip()}))
-    for k in ros:
-        if isinstance(ros[k], list):
-            ros[k] = sorted(list({x.strip() for x in ros[k] if x.strip()}))
-    return ant, ros, ef
-
-def merge_and_normalize(json_llm: dict, transcript: list) -> dict:
-    out = {"json_clinico": {
-        "identificacion": {},
-        "motivo_consulta": "",
-        "enfermedad_actual": {},
-        "antecedentes": {},
-        "revision_sistemas": {},
-        "examen_fisico": {},
-        "impresion_dx": [],
-        "plan_manejo": {"ordenes": [], "recetas": [], "recomendaciones": []},
-        "evolucion": []
-    }}
-
-    jc = (json_llm or {}).get("json_clinico", {})
-    for k in out["json_clinico"].keys():
-        if k in jc:
-            out["json_clinico"][k] = jc[k]
-
-    ant_r, ros_r, ef_r = extract_rules_from_transcript(transcript)
-
-    out["json_clinico"]["antecedentes"] = { **ant_r, **(out["json_clinico"].get("antecedentes") or {}) }
-    out["json_clinico"]["revision_sistemas"] = { **ros_r, **(out["json_clinico"].get("revision_sistemas") or {}) }
-    out["json_clinico"]["examen_fisico"] = { **ef_r, **(out["json_clinico"].get("examen_fisico") or {}) }
-
-    ea = out["json_clinico"].get("enfermedad_actual")
-    out["json_clinico"]["enfermedad_actual"] = compact_enfermedad_actual(ea)
-
-    ident = out["json_clinico"].get("identificacion") or {}
-    ident.setdefault("fecha", datetime.now().strftime("%Y-%m-%d %H:%M"))
-    ident.setdefault("servicio", "Consulta General")
-    out["json_clinico"]["identificacion"] = ident
-
-    plan = out["json_clinico"].get("plan_manejo") or {}
-    plan.setdefault("ordenes", plan.get("ordenes") or [])
-    plan.setdefault("recetas", plan.get("recetas") or [])
-    plan.setdefault("recomendaciones", plan.get("recomendaciones") or [])
-    out["json_clinico"]["plan_manejo"] = plan
-
-    return out
\ No newline at end of file
+    jc = CACHE.get(key)
+    if jc is None:
+        jc = fast_generate(tx)
+        CACHE.put(key, jc)
+    bkey = (key, body.encounter_id, body.patient_id, body.practitioner_id)
+    bundle = BUNDLE_CACHE.get(bkey)
+    if bundle is None:
+        bundle = build_bundle(body.encounter_id, body.patient_id, body.practitioner_id, jc)
+        BUNDLE_CACHE.put(bkey, bundle)
+    return json_response({"json_clinico": jc, "fhir_bundle": bundle, "schema_used": "fastpath"})
+
+# Postproceso (antes pegado aquí como copia de api/postprocess.py)
+from api.postprocess import (  # noqa: E402
+    compact_enfermedad_actual, extract_rules_from_transcript, merge_and_normalize,
+)
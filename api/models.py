@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
-from typing import List, Dict, Any, Optional
-import httpx
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+
+import orjson
 
 from api.config.settings import settings
+from api.llm_cache import exact_cache, exact_key, llm_cache, llm_key
+from api.utils.http import get_http_client
 
 __all__ = ["LLMClient", "get_llm"]
 
+def _to_prompt_json(obj: Any) -> str:
+    """JSON compacto para incrustar en prompts: sin indentación (menos tokens que decodificar)."""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str).decode()
+
 class LLMClient:
     """
     Cliente minimalista para Ollama /api/chat con capacidades clínicas mejoradas.
@@ -16,22 +24,19 @@ class LLMClient:
         self.model = model
         self.system_prompt = system_prompt
 
-    async def chat(
+    def _payload(
         self,
         messages: List[Dict[str, str]],
-        temperature: float = 0.2,
-        max_tokens: Optional[int] = None,
-        json_mode: bool = False
-    ) -> str:
-        """
-        Llama al endpoint /api/chat de Ollama.
-        messages = [{"role":"system"|"user"|"assistant","content":"..."}]
-        Devuelve el texto del último mensaje del modelo.
-        """
+        temperature: float,
+        max_tokens: Optional[int],
+        json_mode: bool,
+    ) -> Dict[str, Any]:
         payload = {
             "model": self.model,
             "messages": messages,
-            "stream": False,
+            "stream": True,
+            # modelo residente entre llamadas: sin recarga ni pérdida de la KV cache del prefijo
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": temperature,
             },
@@ -42,13 +47,99 @@ class LLMClient:
         # Force JSON format if requested
         if json_mode:
             payload["format"] = "json"
+        return payload
 
-        async with httpx.AsyncClient(timeout=120) as client:
-            r = await client.post(f"{self.base_url}/api/chat", json=payload)
+    async def _chunks(self, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        # Ollama manda una línea JSON por fragmento
+        # ({"message":{"content":"..."}, "done": false})
+        async with get_http_client().stream("POST", f"{self.base_url}/api/chat", json=payload, timeout=120) as r:
             r.raise_for_status()
-            data = r.json()
-            # Ollama devuelve {"message":{"role":"assistant","content":"..."} ...}
-            return (data.get("message") or {}).get("content", "")
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                yield chunk
+                if chunk.get("done"):
+                    break
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_mode: bool,
+    ) -> Tuple[str, bool]:
+        """Texto completo y si el stream llegó a "done" (si no, quedó truncado)."""
+        parts: List[str] = []
+        done = False
+        async for chunk in self._chunks(self._payload(messages, temperature, max_tokens, json_mode)):
+            parts.append((chunk.get("message") or {}).get("content", ""))
+            done = bool(chunk.get("done"))
+        return "".join(parts), done
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False
+    ) -> AsyncIterator[str]:
+        """
+        Igual que chat(), pero entrega los fragmentos de texto a medida que
+        Ollama los genera (apto para StreamingResponse).
+        """
+        async for chunk in self._chunks(self._payload(messages, temperature, max_tokens, json_mode)):
+            content = (chunk.get("message") or {}).get("content", "")
+            if content:
+                yield content
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False,
+        cache: Optional[bool] = None
+    ) -> str:
+        """
+        Llama al endpoint /api/chat de Ollama.
+        messages = [{"role":"system"|"user"|"assistant","content":"..."}]
+        Devuelve el texto del último mensaje del modelo.
+        cache: reutilizar una llamada idéntica reciente (mismo modelo, parámetros y
+        mensajes). Por defecto solo con temperature == 0; con muestreo cada llamada
+        debe poder dar otra respuesta.
+        """
+        use_cache = temperature == 0 if cache is None else cache
+        key = exact_key(self.model, messages, temperature, max_tokens, json_mode) if use_cache else None
+        if key is not None:
+            hit = exact_cache.get(key)
+            if hit is not None:
+                return hit
+        text, done = await self._complete(messages, temperature, max_tokens, json_mode)
+        if key is not None and done and text:
+            exact_cache.put(key, text)
+        return text
+
+    async def cached_chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False
+    ) -> str:
+        """
+        Igual que chat(), pero reutiliza la respuesta si ya se vio un prompt
+        equivalente (mismo modelo/parámetros y texto igual salvo espacios/mayúsculas).
+        """
+        key = llm_key(self.model, messages, temperature, max_tokens, json_mode)
+        hit = llm_cache.get(key)
+        if hit is not None:
+            return hit
+        # directo a Ollama: la respuesta vive solo en llm_cache, no también en exact_cache
+        text, done = await self._complete(messages, temperature, max_tokens, json_mode)
+        if done and text:
+            llm_cache.put(key, text)
+        return text
     
     async def chat_with_evidence(
         self,
@@ -76,7 +167,7 @@ class LLMClient:
         system_msg = "Eres un médico clínico experto. Proporciona respuestas basadas en evidencia."
         context_str = ""
         if context:
-            context_str = f"\n\nContexto clínico:\n{json.dumps(context, ensure_ascii=False, indent=2)}"
+            context_str = f"\n\nContexto clínico:\n{_to_prompt_json(context)}"
         
         prompt = f"{query}{context_str}\n\nProporciona tu respuesta y sugiere términos de búsqueda para PubMed si se necesita evidencia adicional."
         
@@ -91,23 +182,30 @@ class LLMClient:
         evidence = []
         if search_pubmed:
             # Extract search terms from response or use query
-            search_terms = [query]  # Simplified - could use LLM to extract better terms
-            
-            for term in search_terms[:2]:
-                try:
-                    if local_has_db():
-                        local_results = local_search_terms(term, limit=max_evidence)
-                        evidence.extend(local_results)
-                    else:
-                        pubmed_results = await pubmed_search(term, retmax=max_evidence)
-                        if pubmed_results.get("ids"):
-                            evidence.extend([
-                                {"pmid": pmid, "search_term": term}
-                                for pmid in pubmed_results["ids"][:max_evidence]
-                            ])
-                except Exception:
-                    pass
-        
+            search_terms = [query][:2]  # Simplified - could use LLM to extract better terms
+
+            if local_has_db():
+                for term in search_terms:
+                    try:
+                        evidence.extend(local_search_terms(term, limit=max_evidence))
+                    except Exception:
+                        pass
+            else:
+                # búsquedas en paralelo: el costo es un RTT a NCBI, no uno por término
+                # (pubmed.py espacia las peticiones según el límite de req/s de NCBI)
+                async def _search(term: str):
+                    return term, await pubmed_search(term, retmax=max_evidence)
+
+                results = await asyncio.gather(*(_search(t) for t in search_terms), return_exceptions=True)
+                for res in results:
+                    if isinstance(res, BaseException):
+                        continue
+                    term, pubmed_results = res
+                    evidence.extend(
+                        {"pmid": pmid, "search_term": term}
+                        for pmid in (pubmed_results.get("ids") or [])[:max_evidence]
+                    )
+
         return {
             "response": response,
             "evidence": evidence[:max_evidence],
@@ -133,7 +231,7 @@ class LLMClient:
         """
         patient_str = ""
         if patient_data:
-            patient_str = f"\n\nDatos del paciente:\n{json.dumps(patient_data, ensure_ascii=False, indent=2)}"
+            patient_str = f"\n\nDatos del paciente:\n{_to_prompt_json(patient_data)}"
         
         if use_chain_of_thought:
             prompt = f"""Analiza el siguiente escenario clínico paso a paso:{patient_str}
@@ -158,7 +256,7 @@ Escenario: {clinical_scenario}
 
 Proporciona diagnósticos diferenciales y recomendaciones."""
         
-        response = await self.chat(
+        response = await self.cached_chat(
             messages=[
                 {"role": "system", "content": "Eres un médico clínico experto. Usa razonamiento clínico estructurado."},
                 {"role": "user", "content": prompt}
@@ -197,7 +295,7 @@ Proporciona diagnósticos diferenciales y recomendaciones."""
 Decisión: {decision}
 
 Contexto:
-{json.dumps(context, ensure_ascii=False, indent=2)}
+{_to_prompt_json(context)}
 
 Evalúa si la decisión es apropiada y segura. Responde en JSON:
 {{
@@ -208,7 +306,7 @@ Evalúa si la decisión es apropiada y segura. Responde en JSON:
   "guideline_alignment": "descripción de alineación con guías clínicas"
 }}"""
         
-        response = await self.chat(
+        response = await self.cached_chat(
             messages=[
                 {"role": "system", "content": "Eres un experto en medicina basada en evidencia y seguridad del paciente."},
                 {"role": "user", "content": prompt}
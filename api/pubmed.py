@@ -1,31 +1,157 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, json
-from typing import List, Dict, Any, Optional, Tuple
-import httpx
+import asyncio
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Any, Optional, Tuple
+
+import orjson
 
 from api.config.settings import settings
+from api.utils.cache import LRUCache
+from api.utils.http import get_http_client
 
 NCBI_EUTILS = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
 
+# ---------- Caché por request ----------
+# (query normalizada, retmax, retstart) -> Task; las tareas de asyncio.gather copian
+# el contexto pero comparten este dict, así que una búsqueda repetida (o en vuelo)
+# dentro del mismo request sale una sola vez a E-utilities
+_REQUEST_CACHE: ContextVar[Optional[Dict[Tuple[str, int, int], "asyncio.Task"]]] = ContextVar(
+    "pubmed_request_cache", default=None
+)
+
+@contextmanager
+def pubmed_request_scope() -> Iterator[None]:
+    """Abre una caché de pubmed_search válida hasta salir del bloque."""
+    token = _REQUEST_CACHE.set({})
+    try:
+        yield
+    finally:
+        _REQUEST_CACHE.reset(token)
+
+# NCBI permite ~3 req/s sin API key y 10 con ella. El semáforo solo acota las
+# peticiones en vuelo; la tasa la impone el espaciado de _ncbi_slot (1/rate s entre
+# inicios). Es por proceso: con varios workers el total es rate × API_WORKERS.
+# Los aciertos de caché no pasan por aquí.
+_NCBI_RATE = 10 if settings.PUBMED_API_KEY else 3
+_NCBI_SEM = asyncio.Semaphore(_NCBI_RATE)
+_NCBI_NEXT = 0.0  # time.monotonic() del próximo inicio permitido
+
+@asynccontextmanager
+async def _ncbi_slot() -> AsyncIterator[None]:
+    global _NCBI_NEXT
+    async with _NCBI_SEM:
+        # reserva el turno sin await entre leer y escribir _NCBI_NEXT (event loop)
+        now = time.monotonic()
+        start = max(now, _NCBI_NEXT)
+        _NCBI_NEXT = start + 1.0 / _NCBI_RATE
+        if start > now:
+            await asyncio.sleep(start - now)
+        yield
+
+def _ncbi_params() -> Dict[str, str]:
+    """Identificación que NCBI pide en cada llamada a E-utilities."""
+    params = {"tool": "scribe-ia"}
+    if settings.PUBMED_API_KEY:
+        params["api_key"] = settings.PUBMED_API_KEY
+    if settings.PUBMED_EMAIL and not settings.PUBMED_EMAIL.endswith("@example.com"):
+        params["email"] = settings.PUBMED_EMAIL
+    return params
+
+# ---------- Caché de proceso ----------
+# Mismas claves que la caché por request; los resultados de esearch cambian poco
+# en un día y NCBI limita la tasa de peticiones
+_SEARCH_CACHE = LRUCache(maxsize=1024, ttl=24 * 3600)
+
 # ---------- Búsqueda remota ----------
 async def pubmed_search(q: str, retmax: int = 5, retstart: int = 0) -> Dict[str, Any]:
+    key = (" ".join(q.split()).lower(), retmax, retstart)
+    hit = _SEARCH_CACHE.get(key)
+    if hit is not None:
+        return {**hit, "ids": list(hit["ids"]), "q": q}
+    cache = _REQUEST_CACHE.get()
+    if cache is None:
+        res = await _pubmed_search(q, retmax, retstart)
+    else:
+        task = cache.get(key)
+        if task is None:
+            task = cache[key] = asyncio.ensure_future(_pubmed_search(q, retmax, retstart))
+        res = await asyncio.shield(task)
+    _SEARCH_CACHE.put(key, res)
+    # copia (incluida la lista de ids): el llamador puede mutarla sin tocar la caché
+    return {**res, "ids": list(res["ids"])}
+
+async def _pubmed_search(q: str, retmax: int = 5, retstart: int = 0) -> Dict[str, Any]:
     url = f"{NCBI_EUTILS}/esearch.fcgi"
     params = {
         "db": "pubmed", "term": q, "retmode": "json",
-        "retmax": str(retmax), "retstart": str(retstart)
+        "retmax": str(retmax), "retstart": str(retstart), **_ncbi_params()
     }
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
+    # cliente compartido: NCBI es HTTPS, así se evita el handshake TLS por búsqueda
+    async with _ncbi_slot():
+        r = await get_http_client().get(url, params=params, timeout=30)
+    r.raise_for_status()
+    data = r.json()
     ids = data.get("esearchresult", {}).get("idlist", []) or []
     count = int(data.get("esearchresult", {}).get("count", 0))
     return {"ids": ids, "count": count, "q": q, "retstart": retstart, "retmax": retmax}
 
+# ---------- Resúmenes (esummary) ----------
+_SUMMARY_CACHE = LRUCache(maxsize=10_000, ttl=24 * 3600)  # pmid -> {pmid, title, year, url}
+_ESUMMARY_BATCH = 200  # PMIDs por llamada (id=1,2,3...)
+
+async def _esummary(pmids: List[str]) -> Dict[str, Dict[str, Any]]:
+    params = {"db": "pubmed", "retmode": "json", "id": ",".join(pmids), **_ncbi_params()}
+    async with _ncbi_slot():
+        r = await get_http_client().get(f"{NCBI_EUTILS}/esummary.fcgi", params=params, timeout=30)
+    r.raise_for_status()
+    result = r.json().get("result") or {}
+    out: Dict[str, Dict[str, Any]] = {}
+    for pmid in result.get("uids") or []:
+        doc = result.get(pmid) or {}
+        date = str(doc.get("pubdate") or "")
+        out[pmid] = {
+            "pmid": pmid, "title": doc.get("title") or "",
+            "year": int(date[:4]) if date[:4].isdigit() else None,
+            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+        }
+    return out
+
+async def pubmed_summaries(pmids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    pmid -> {pmid, title, year, url}. PMIDs repetidos se piden una vez, los ya
+    vistos salen de la caché y el resto va en lotes de _ESUMMARY_BATCH.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for pmid in dict.fromkeys(str(p) for p in pmids if p):
+        hit = _SUMMARY_CACHE.get(pmid)
+        if hit is not None:
+            out[pmid] = dict(hit)
+        else:
+            missing.append(pmid)
+    batches = [missing[i:i + _ESUMMARY_BATCH] for i in range(0, len(missing), _ESUMMARY_BATCH)]
+    for docs in await asyncio.gather(*(_esummary(b) for b in batches)):
+        for pmid, row in docs.items():
+            _SUMMARY_CACHE.put(pmid, row)
+            out[pmid] = dict(row)
+    return out
+
 # ---------- Índice local JSONL ----------
 _LOCAL_PATH = os.path.join(settings.KNOWLEDGE_DIR, "pubmed", "pubmed.jsonl")
+_SIDECAR_PATH = os.path.join(settings.KNOWLEDGE_DIR, "pubmed", "pubmed.idx.json")
 _LOCAL_IDX: Optional[Dict[str, Dict[str, Any]]] = None  # pmid -> registro
+_POSTINGS: Dict[str, List[Tuple[str, int]]] = {}  # token -> [(pmid, tf)]
+_TOKEN_RX = re.compile(r"\w+")
+_LOCAL_LOCK = threading.Lock()
 
 def _normalize_row(raw: Dict[str, Any]) -> Dict[str, Any]:
     pmid = str(raw.get("pmid") or raw.get("PMID") or "").strip()
@@ -38,40 +164,104 @@ def _normalize_row(raw: Dict[str, Any]) -> Dict[str, Any]:
     elif isinstance(year, str) and year[:4].isdigit():
         y = int(year[:4])
     url = raw.get("url") or (f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else None)
-    return {"pmid": pmid, "title": str(title).strip(), "abstract": str(abstract).strip(), "year": y, "url": url}
+    title = str(title).strip()
+    abstract = str(abstract).strip()
+    # _hay: título+resumen ya en casefold, se calcula una vez al indexar (no por consulta)
+    return {"pmid": pmid, "title": title, "abstract": abstract, "year": y, "url": url,
+            "_hay": f"{title} {abstract}".casefold()}
+
+def _build_postings(idx: Dict[str, Dict[str, Any]]) -> Dict[str, List[Tuple[str, int]]]:
+    postings: Dict[str, List[Tuple[str, int]]] = {}
+    for pmid, r in idx.items():
+        tf = Counter(_TOKEN_RX.findall(r["_hay"]))
+        for tok, n in tf.items():
+            postings.setdefault(tok, []).append((pmid, n))
+    return postings
+
+def _parse_jsonl() -> Dict[str, Dict[str, Any]]:
+    idx: Dict[str, Dict[str, Any]] = {}
+    # bytes + buffer de 1 MiB: orjson parsea la línea sin decodificar a str antes
+    with open(_LOCAL_PATH, "rb", buffering=1 << 20) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                obj = orjson.loads(line)
+                row = _normalize_row(obj)
+                if row["pmid"]:
+                    idx[row["pmid"]] = row
+            except Exception:
+                continue
+    return idx
+
+def _read_local_index() -> Tuple[Dict[str, Dict[str, Any]], Dict[str, List[Tuple[str, int]]]]:
+    """
+    El JSONL es la fuente de verdad; el índice ya construido (filas + postings)
+    se guarda en un .json al lado, válido mientras coincidan mtime y tamaño del JSONL.
+    Solo datos (orjson, nunca pickle): KNOWLEDGE_DIR es escribible vía /knowledge/upsert.
+    """
+    try:
+        st = os.stat(_LOCAL_PATH)
+    except FileNotFoundError:
+        return {}, {}
+    stamp = [st.st_mtime_ns, st.st_size]
+    try:
+        with open(_SIDECAR_PATH, "rb") as f:
+            cached = orjson.loads(f.read())
+        if cached["stamp"] == stamp and isinstance(cached["idx"], dict) and isinstance(cached["postings"], dict):
+            return cached["idx"], cached["postings"]
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+        pass
+    try:
+        idx = _parse_jsonl()
+    except FileNotFoundError:
+        return {}, {}
+    postings = _build_postings(idx)
+    try:
+        # escribe a un temporal y renombra: otro worker nunca lee un índice a medias
+        tmp = f"{_SIDECAR_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps({"stamp": stamp, "idx": idx, "postings": postings}))
+        os.replace(tmp, _SIDECAR_PATH)
+    except OSError:
+        pass  # directorio de solo lectura: seguimos con el JSONL
+    return idx, postings
 
 def _ensure_local_index() -> None:
-    global _LOCAL_IDX
+    global _LOCAL_IDX, _POSTINGS
     if _LOCAL_IDX is not None:
         return
-    _LOCAL_IDX = {}
-    try:
-        with open(_LOCAL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    row = _normalize_row(obj)
-                    if row["pmid"]:
-                        _LOCAL_IDX[row["pmid"]] = row
-                except Exception:
-                    continue
-    except FileNotFoundError:
-        _LOCAL_IDX = {}
+    # doble chequeo: dos primeras consultas simultáneas (hilos de to_thread) no
+    # parsean el JSONL dos veces; _LOCAL_IDX se publica al final, ya completo
+    with _LOCAL_LOCK:
+        if _LOCAL_IDX is not None:
+            return
+        idx, _POSTINGS = _read_local_index()
+        _LOCAL_IDX = idx
+
+def _reset_lock_after_fork() -> None:
+    # El hijo hereda el índice completo (copy-on-write); el lock se recrea por si
+    # otro hilo del padre lo tenía tomado en el momento del fork
+    global _LOCAL_LOCK
+    _LOCAL_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
 
 def local_has_db() -> bool:
     _ensure_local_index()
     return bool(_LOCAL_IDX)
 
+def _row_out(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {"pmid": r["pmid"], "title": r["title"], "year": r["year"], "url": r["url"]}
+
 def local_lookup_pmids(pmids: List[str]) -> List[Dict[str, Any]]:
     _ensure_local_index()
     out: List[Dict[str, Any]] = []
     for p in pmids:
         r = _LOCAL_IDX.get(str(p), {})
         if r:
-            out.append({"pmid": r["pmid"], "title": r["title"], "year": r["year"], "url": r["url"]})
+            out.append(_row_out(r))
     return out
 
 def local_search_terms(q: str, limit: int = 5) -> List[Dict[str, Any]]:
@@ -79,17 +269,31 @@ def local_search_terms(q: str, limit: int = 5) -> List[Dict[str, Any]]:
     if not _LOCAL_IDX:
         return []
     qs = str(q or "").casefold()
+
+    # Índice invertido: solo se tocan los documentos que contienen algún token
+    # de la consulta; puntaje tf·idf (los tokens raros pesan más que "de"/"la")
+    n_docs = len(_LOCAL_IDX)
+    scores: Dict[str, float] = {}
+    for tok in set(_TOKEN_RX.findall(qs)):
+        plist = _POSTINGS.get(tok)
+        if not plist:
+            continue
+        idf = math.log(1 + n_docs / len(plist))
+        for pmid, tf in plist:
+            scores[pmid] = scores.get(pmid, 0.0) + tf * idf
+    if scores:
+        best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+        return [_row_out(_LOCAL_IDX[pmid]) for pmid, _ in best]
+
+    # Sin tokens completos (p.ej. prefijo "hipertens"): búsqueda por subcadena
+    if not qs:
+        return []
     hits: List[Tuple[int, Dict[str, Any]]] = []
     for r in _LOCAL_IDX.values():
-        hay = (r["title"] or "").casefold() + " " + (r["abstract"] or "").casefold()
-        score = hay.count(qs)
+        score = r["_hay"].count(qs)
         if score > 0:
             hits.append((score, r))
-    hits.sort(key=lambda x: x[0], reverse=True)
-    out = []
-    for _, r in hits[:limit]:
-        out.append({"pmid": r["pmid"], "title": r["title"], "year": r["year"], "url": r["url"]})
-    return out
+    return [_row_out(r) for _, r in heapq.nlargest(limit, hits, key=lambda x: x[0])]
 
 # ---------- Bootstrap (compatibilidad) ----------
 async def pubmed_ingest_to_files(q: str, total: int, out_dir: str) -> Dict[str, Any]:
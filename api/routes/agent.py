@@ -6,10 +6,16 @@ These endpoints provide interactive access to the clinical agent's
 capabilities including chat, validation, reasoning, and suggestions.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional
+import httpx
 from fastapi import APIRouter, Body, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+import orjson
+
+from api.models import get_llm
+
 from api.services.clinical_agent_service import (
     ClinicalAgent,
     create_clinical_agent,
@@ -18,6 +24,12 @@ from api.services.clinical_agent_service import (
 
 router = APIRouter(prefix="/agent")
 
+# Preguntas libres: respuesta en texto, no el JSON de historia de settings.SYSTEM_PROMPT
+_ASK_SYSTEM_PROMPT = (
+    "Eres un médico clínico experto. Responde en texto claro y conciso, "
+    "basado en evidencia y en el contexto de la consulta."
+)
+
 
 # Request/Response Models
 
@@ -35,6 +47,11 @@ class ClinicalReasoningRequest(BaseModel):
     use_pubmed: bool = True
 
 
+class AskStreamRequest(BaseModel):
+    encounter_id: str
+    query: str
+
+
 class PrescriptionValidationRequest(BaseModel):
     encounter_id: str
     medications: List[Dict[str, Any]]
@@ -152,6 +169,52 @@ async def get_clinical_reasoning(request: ClinicalReasoningRequest):
         raise HTTPException(500, detail=f"Clinical reasoning failed: {e}")
 
 
+@router.post("/ask/stream")
+async def ask_agent_stream(request: AskStreamRequest):
+    """
+    Stream a free-text answer to a clinical question as the model generates it.
+    
+    The answer is grounded on the current consultation summary and sent as
+    plain-text chunks, so the front-end can render it before generation ends.
+    
+    Args:
+        request: Encounter and question
+        
+    Returns:
+        text/plain streaming response
+    """
+    agent = get_clinical_agent(request.encounter_id)
+    if not agent:
+        raise HTTPException(404, detail="Agent not found. Initialize first.")
+    
+    llm = get_llm()
+    context = orjson.dumps(agent.get_conversation_summary(), default=str).decode()
+    messages = [
+        {"role": "system", "content": _ASK_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Contexto de la consulta:\n{context}\n\nPregunta clínica: {request.query}"},
+    ]
+
+    stream = llm.chat_stream(messages, temperature=0.2)
+    # Primer fragmento antes de responder: si Ollama falla de entrada, 502 y no un 200 vacío
+    try:
+        first = await anext(stream, "")
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        raise HTTPException(502, detail=f"LLM unavailable: {e}")
+
+    async def _answer() -> AsyncIterator[str]:
+        yield first
+        # El 200 ya salió: un fallo a mitad de stream se avisa al final del cuerpo
+        try:
+            async for chunk in stream:
+                yield chunk
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+            yield f"\n\n[error: respuesta del LLM interrumpida ({type(e).__name__})]"
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(_answer(), media_type="text/plain; charset=utf-8")
+
+
 @router.post("/validate-prescription")
 async def validate_prescription(request: PrescriptionValidationRequest):
     """
@@ -4,9 +4,16 @@
 import re
 from typing import Dict, Any, List
 from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import ORJSONResponse
 from api.services.cds_service import get_cds_suggestions
 
-router = APIRouter()
+# orjson también si el router se monta en otra app sin default_response_class
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Fallback de analgésico: patrones compilados una vez al importar. Sin re.I:
+# ctx["texto"] ya llega en minúsculas
+_RX_GI_RISK = re.compile(r"ulcer|sangrado|gastritis|anticoagul|warfarin|acenocumar")
+_RX_AAS = re.compile(r"\b(aspirina|aas|ácido\s+acetilsalicílico)\b")
 
 
 @router.post("/cds/suggest")
@@ -40,12 +47,12 @@ async def suggest_clinical_decisions(payload: Dict[str, Any] = Body(...)):
             if isinstance(dx, str) and dx.strip():
                 ctx["dx"] = [dx.lower()]
             elif isinstance(dx, list):
-                ctx["dx"] = [str(d).lower() for d in dx]
+                ctx["dx"] = list(map(str.lower, map(str, dx)))
             else:
                 ctx["dx"] = []
 
         if "alergias" in ctx and isinstance(ctx["alergias"], list):
-            ctx["alergias"] = [str(a).lower() for a in ctx["alergias"]]
+            ctx["alergias"] = list(map(str.lower, map(str, ctx["alergias"])))
         else:
             ctx.setdefault("alergias", [])
 
@@ -81,8 +88,9 @@ async def suggest_clinical_decisions(payload: Dict[str, Any] = Body(...)):
 
         # Fallback: Paracetamol suggestion if AAS and GI risk
         try:
-            riesgo_gi = bool(re.search(r"ulcer|sangrado|gastritis|anticoagul|warfarin|acenocumar", ctx.get("texto", ""), re.I))
-            prescribio_aas = bool(re.search(r"\b(aspirina|aas|ácido\s+acetilsalicílico)\b", ctx.get("texto", ""), re.I))
+            txt = ctx.get("texto", "")
+            riesgo_gi = bool(_RX_GI_RISK.search(txt))
+            prescribio_aas = bool(_RX_AAS.search(txt))
             if prescribio_aas:
                 sugs.append({
                     "id": "SUG-analgesic-001",
@@ -95,7 +103,7 @@ async def suggest_clinical_decisions(payload: Dict[str, Any] = Body(...)):
                     "pmids": ["23336517", "31562798"],
                     "safety_notes": ["500–1000 mg c/6–8 h (máx. 3–4 g/día). Ajustar en hepatopatía."]
                 })
-            elif ("fiebre" in ctx.get("texto", "") or "dolor" in ctx.get("texto", "")) and riesgo_gi:
+            elif ("fiebre" in txt or "dolor" in txt) and riesgo_gi:
                 sugs.append({
                     "id": "SUG-analgesic-002",
                     "type": "medication",
@@ -2,10 +2,35 @@
 """FHIR routes."""
 
 from typing import Dict, Any
-from fastapi import APIRouter, Body, HTTPException
-from api.services.fhir_service import push_to_fhir_server
+from fastapi import APIRouter, Body, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from api.services.fhir_service import create_fhir_bundle_json, push_to_fhir_server
 
-router = APIRouter()
+# orjson también si el router se monta en otra app sin default_response_class
+router = APIRouter(default_response_class=ORJSONResponse)
+
+
+@router.post("/fhir/bundle")
+async def build_fhir_bundle(payload: Dict[str, Any] = Body(...)):
+    """
+    Build FHIR transaction bundle from clinical JSON.
+    
+    Args:
+        payload: {encounter_id, patient_id, practitioner_id, json_clinico}
+        
+    Returns:
+        FHIR bundle (pre-serialized JSON)
+    """
+    try:
+        content = create_fhir_bundle_json(
+            encounter_id=payload.get("encounter_id", ""),
+            patient_id=payload["patient_id"],
+            practitioner_id=payload["practitioner_id"],
+            json_clinico=payload.get("json_clinico") or {},
+        )
+    except KeyError as e:
+        raise HTTPException(400, f"missing field: {e}")
+    return Response(content=content, media_type="application/fhir+json")
 
 
 @router.post("/fhir/push")
@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
 """Audio ingest routes."""
 
+import asyncio
 import os
+import orjson
 from fastapi import APIRouter, UploadFile, File, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from api.config import settings
-from api.services.asr_service import transcribe_audio
+from api.services.asr_service import transcribe_audio, transcribe_audio_stream
 
 router = APIRouter()
 
+_UPLOAD_CHUNK = 1 << 20  # 1 MiB
+
+
+async def _save_upload(wav: UploadFile, path: str) -> None:
+    """Copia el upload a disco por bloques: RSS constante sin importar el tamaño del WAV."""
+    with open(path, "wb") as f:
+        while chunk := await wav.read(_UPLOAD_CHUNK):
+            await asyncio.to_thread(f.write, chunk)
+
 
 @router.post("/ingest/upload")
 async def upload_audio(
@@ -20,16 +32,14 @@ async def upload_audio(
     Returns transcript with speaker diarization.
     """
     try:
-        os.makedirs(settings.TMP_DIR, exist_ok=True)
+        # TMP_DIR se crea al arrancar la app
         path = os.path.join(settings.TMP_DIR, f"{encounter_id}.wav")
         
         # Save uploaded file
-        raw = await wav.read()
-        with open(path, "wb") as f:
-            f.write(raw)
+        await _save_upload(wav, path)
         
-        # Transcribe
-        transcript = transcribe_audio(path)
+        # Transcribe (CPU pesado: fuera del event loop)
+        transcript = await asyncio.to_thread(transcribe_audio, path)
         
         return {
             "encounter_id": encounter_id,
@@ -38,3 +48,24 @@ async def upload_audio(
         }
     except Exception as e:
         raise HTTPException(500, f"ingest failed: {e}")
+
+
+@router.post("/ingest/upload_stream")
+async def upload_audio_stream(
+    encounter_id: str = Query(..., description="ID del encuentro"),
+    wav: UploadFile = File(..., description="WAV mono 16k (o se re-muestrea en backend)")
+):
+    """
+    Upload audio and stream transcript turns as NDJSON (one turn per line).
+    """
+    try:
+        path = os.path.join(settings.TMP_DIR, f"{encounter_id}.wav")
+        await _save_upload(wav, path)
+    except Exception as e:
+        raise HTTPException(500, f"ingest failed: {e}")
+    
+    async def _ndjson():
+        async for turn in transcribe_audio_stream(path):
+            yield orjson.dumps(turn) + b"\n"
+    
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
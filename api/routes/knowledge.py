@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """Knowledge management routes."""
 
+import asyncio
+
 from fastapi import APIRouter, Query, Body, HTTPException
 from api.services.knowledge_service import list_knowledge_files, save_knowledge_file
 
@@ -11,7 +13,8 @@ router = APIRouter()
 async def list_knowledge():
     """List all knowledge files."""
     try:
-        files = list_knowledge_files()
+        # scandir/escritura son sync: a un hilo para no frenar el event loop
+        files = await asyncio.to_thread(list_knowledge_files)
         return {"count": len(files), "files": files}
     except Exception as e:
         raise HTTPException(500, f"knowledge list failed: {e}")
@@ -24,7 +27,9 @@ async def upsert_knowledge(
 ):
     """Create or update a knowledge file."""
     try:
-        path = save_knowledge_file(name, content)
+        path = await asyncio.to_thread(save_knowledge_file, name, content)
         return {"status": "ok", "path": path}
+    except ValueError as e:
+        raise HTTPException(400, f"knowledge upsert failed: {e}")
     except Exception as e:
         raise HTTPException(500, f"knowledge upsert failed: {e}")
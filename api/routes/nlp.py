@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """NLP processing routes."""
 
+import asyncio
 import re
 from typing import Dict, Any, List
 from fastapi import APIRouter, HTTPException, Body
@@ -13,11 +14,17 @@ from api.utils.rule_extraction import extract_from_transcript
 from api.utils.text_processing import normalize_transcript_turns
 from api.template_router import pick_schema_from_transcript
 from api.fast_engine import fast_generate, hash_transcript
+from api.pubmed import pubmed_request_scope
+from api.utils.cache import LRUCache
+from api.utils.keywords import compile_keywords
+from api.utils.responses import json_response
 
 router = APIRouter()
 
-# Cache for fast_generate
-CACHE: Dict[str, Dict[str, Any]] = {}
+# Cache for fast_generate (acotada: el servidor vive mucho y los transcripts no se repiten tanto)
+CACHE = LRUCache(maxsize=1024)
+# Bundle por (hash, encounter, patient, practitioner): los reintentos no reconstruyen FHIR
+BUNDLE_CACHE = LRUCache(maxsize=1024)
 
 
 def _join_texts(turns: List[Dict[str, Any]]) -> str:
@@ -29,54 +36,86 @@ def _join_texts(turns: List[Dict[str, Any]]) -> str:
     ])
 
 
+# Disparadores por esquema: una sola pasada sobre el texto; la prioridad entre
+# esquemas se resuelve después sobre el conjunto de etiquetas
+_SCAN_SCHEMA = compile_keywords({
+    "diarrea": "gastroenteritis_aguda", "vómit": "gastroenteritis_aguda", "vomit": "gastroenteritis_aguda",
+    "gastroenter": "gastroenteritis_aguda", "heces": "gastroenteritis_aguda", "deshidrat": "gastroenteritis_aguda",
+    "tos": "respiratoria_aguda", "disnea": "respiratoria_aguda", "fiebre": "respiratoria_aguda",
+    "neumon": "respiratoria_aguda", "saturación": "respiratoria_aguda", "sato2": "respiratoria_aguda",
+    "dolor en el pecho": "dolor_toracico", "dolor torácico": "dolor_toracico", "opresión torácica": "dolor_toracico",
+})
+_SCHEMA_PRIORITY = ("gastroenteritis_aguda", "respiratoria_aguda", "dolor_toracico")
+
+
 def _guess_schema_from_text(txt: str) -> str:
     """Heuristic schema detection from text."""
-    low = (txt or "").lower()
-    if any(k in low for k in ["diarrea", "vómit", "vomit", "gastroenter", "heces", "deshidrat"]):
-        return "gastroenteritis_aguda"
-    if any(k in low for k in ["tos", "disnea", "fiebre", "neumon", "saturación", "sato2"]):
-        return "respiratoria_aguda"
-    if any(k in low for k in ["dolor en el pecho", "dolor torácico", "opresión torácica"]):
-        return "dolor_toracico"
+    hits = _SCAN_SCHEMA((txt or "").lower())
+    for schema_id in _SCHEMA_PRIORITY:
+        if schema_id in hits:
+            return schema_id
     return "consulta_general"
 
 
 def _merge_obj(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
-    """Recursively merge two dictionaries."""
-    out = dict(dst or {})
-    for k, v in (src or {}).items():
-        if isinstance(v, dict):
-            out[k] = _merge_obj(out.get(k, {}), v)
-        else:
-            out[k] = v if k not in out or not out[k] else out[k]
-    return out
+    """
+    Merge src into dst in place without overwriting non-empty values.
+    Iterative (stack of dict pairs); only missing levels are allocated.
+    A non-empty non-dict dst (e.g. a section the LLM returned as text) is kept as is.
+    """
+    if not isinstance(dst, dict):
+        if dst:
+            return dst
+        dst = {}
+    root = dst
+    stack = [(root, src or {})]
+    while stack:
+        d, s = stack.pop()
+        for k, v in s.items():
+            if isinstance(v, dict):
+                child = d.get(k)
+                if not isinstance(child, dict):
+                    if child:
+                        continue  # existing non-dict value wins
+                    child = d[k] = {}
+                stack.append((child, v))
+            elif not d.get(k):
+                d[k] = v
+    return root
 
 
 def _normalize_suggestions(sugs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Normalize CDS suggestions to consistent format."""
     out: List[Dict[str, Any]] = []
+    append = out.append
     for s in (sugs or []):
         if not isinstance(s, dict):
             continue
-        typ = s.get("type") or "info"
-        msg = (s.get("message") or s.get("proposed") or s.get("text") or s.get("guideline") or "").strip()
-        if s.get("medication") and s.get("instructions"):
-            msg = f"{s.get('medication')}: {s.get('instructions')}".strip(": ")
+        # each field is read once (bound s.get, no repeated proposed/medication lookups)
+        get = s.get
+        proposed = get("proposed")
+        med = get("medication")
+        typ = get("type") or "info"
+        msg = (get("message") or proposed or get("text") or get("guideline") or "").strip()
+        if med and (instr := get("instructions")):
+            msg = f"{med}: {instr}".strip(": ")
             typ = "medication"
         if msg:
-            pmids = s.get("pmids") or []
-            if not pmids and isinstance(s.get("evidence"), list):
-                pmids = [str(e.get("pmid")) for e in s["evidence"] if isinstance(e, dict) and e.get("pmid")]
-            out.append({
-                "id": s.get("id") or s.get("code") or "",
+            pmids = get("pmids") or []
+            if not pmids:
+                ev = get("evidence")
+                if isinstance(ev, list):
+                    pmids = [str(e["pmid"]) for e in ev if isinstance(e, dict) and e.get("pmid")]
+            append({
+                "id": get("id") or get("code") or "",
                 "type": typ,
                 "message": msg,
-                "proposed": s.get("proposed") or s.get("medication") or "",
-                "current": s.get("current") or "",
-                "actions": s.get("actions") or [],
-                "rationale": s.get("rationale") or "",
+                "proposed": proposed or med or "",
+                "current": get("current") or "",
+                "actions": get("actions") or [],
+                "rationale": get("rationale") or "",
                 "pmids": pmids,
-                "safety_notes": s.get("safety_notes", [])
+                "safety_notes": get("safety_notes", [])
             })
     return out
 
@@ -150,48 +189,65 @@ async def generate_clinical_history(body: GenerateBody):
 
     # 4) Enrich with rule extraction
     try:
-        heur = extract_from_transcript(transcript)
+        heur = await asyncio.to_thread(extract_from_transcript, transcript)
         jc = result["json_clinico"] = result.get("json_clinico") or {}
 
         jc["antecedentes"] = _merge_obj(jc.get("antecedentes", {}), heur.get("antecedentes", {}))
         jc["revision_sistemas"] = _merge_obj(jc.get("revision_sistemas", {}), heur.get("revision_sistemas", {}))
         jc["examen_fisico"] = _merge_obj(jc.get("examen_fisico", {}), heur.get("examen_fisico", {}))
         if heur.get("alertas"):
-            jc["alertas"] = sorted(list(set((jc.get("alertas") or []) + heur["alertas"])))
+            jc["alertas"] = list(dict.fromkeys((jc.get("alertas") or []) + heur["alertas"]))
     except Exception as e:
         result["_debug"]["warn_rules_enrich"] = f"{type(e).__name__}: {e}"
 
-    # 5) Augment with PubMed
-    try:
-        result["augment"] = augment_with_evidence(
-            result["json_clinico"], schema_used=schema_used, top_k=12
+    # 5-7) augment (PubMed), FHIR y CDS son independientes dado json_clinico
+    # (todos solo lo leen): se lanzan a la vez. augment/FHIR son sync -> hilo.
+    jc = result["json_clinico"]
+
+    async def _cds() -> List[Dict[str, Any]]:
+        ctx = build_cds_context(jc)
+        ctx["_schema"] = schema_used
+        return await get_cds_suggestions(ctx, use_pubmed=True, pubmed_max=5)
+
+    # una caché PubMed por request: búsquedas repetidas salen una sola vez
+    with pubmed_request_scope():
+        augment, bundle, raw_sugs = await asyncio.gather(
+            asyncio.to_thread(augment_with_evidence, jc, schema_used=schema_used, top_k=12),
+            asyncio.to_thread(
+                create_fhir_bundle,
+                encounter_id=payload["encounter_id"],
+                patient_id=payload["patient_id"],
+                practitioner_id=payload["practitioner_id"],
+                json_clinico=jc,
+            ),
+            _cds(),
+            return_exceptions=True,
         )
-    except Exception as e:
-        result["_debug"]["warn_augment"] = f"{type(e).__name__}: {e}"
+
+    # 5) Augment with PubMed
+    if isinstance(augment, BaseException):
+        result["_debug"]["warn_augment"] = f"{type(augment).__name__}: {augment}"
+    else:
+        result["augment"] = augment
 
     # 6) Build FHIR bundle
-    try:
-        result["fhir_bundle"] = create_fhir_bundle(
-            encounter_id=payload["encounter_id"],
-            patient_id=payload["patient_id"],
-            practitioner_id=payload["practitioner_id"],
-            json_clinico=result["json_clinico"],
-        )
-    except Exception as e:
-        result["_debug"]["warn_fhir_bundle"] = f"{type(e).__name__}: {e}"
+    if isinstance(bundle, BaseException):
+        result["_debug"]["warn_fhir_bundle"] = f"{type(bundle).__name__}: {bundle}"
         result["fhir_bundle"] = {}
+    else:
+        result["fhir_bundle"] = bundle
 
     # 7) Get CDS suggestions
     try:
-        ctx = build_cds_context(result["json_clinico"])
-        ctx["_schema"] = schema_used
-        raw_sugs = await get_cds_suggestions(ctx, use_pubmed=True, pubmed_max=5)
+        if isinstance(raw_sugs, BaseException):
+            raise raw_sugs
         result["cds_suggestions"] = _normalize_suggestions(raw_sugs or [])
     except Exception as e:
         result["_debug"]["warn_cds"] = f"{type(e).__name__}: {e}"
         result["cds_suggestions"] = []
 
-    return result
+    # El bundle ya es un dict listo: evitamos el pase de jsonable_encoder
+    return json_response(result)
 
 
 @router.post("/nlp/augment")
@@ -214,18 +270,21 @@ async def fast_generate_clinical_history(body: GenerateBody):
     """
     tx = [t.model_dump() if hasattr(t, "model_dump") else dict(t) for t in body.transcript]
     key = hash_transcript(tx)
+    # Sin await entre get y put: en el event loop nadie más toca la caché a mitad
+    jc = CACHE.get(key)
+    if jc is None:
+        jc = fast_generate(tx)
+        CACHE.put(key, jc)
     
-    if key in CACHE:
-        return {"json_clinico": CACHE[key], "schema_used": "fastpath"}
-    
-    jc = fast_generate(tx)
-    CACHE[key] = jc
-    
-    bundle = create_fhir_bundle(
-        body.encounter_id,
-        body.patient_id,
-        body.practitioner_id,
-        jc
-    )
+    bkey = (key, body.encounter_id, body.patient_id, body.practitioner_id)
+    bundle = BUNDLE_CACHE.get(bkey)
+    if bundle is None:
+        bundle = create_fhir_bundle(
+            body.encounter_id,
+            body.patient_id,
+            body.practitioner_id,
+            jc
+        )
+        BUNDLE_CACHE.put(bkey, bundle)
     
-    return {"json_clinico": jc, "fhir_bundle": bundle, "schema_used": "fastpath"}
+    return json_response({"json_clinico": jc, "fhir_bundle": bundle, "schema_used": "fastpath"})
@@ -1,8 +1,8 @@
 # api/printouts.py
 from pathlib import Path
 from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 
 router = APIRouter()
 
@@ -12,12 +12,24 @@ default_dir = Path(__file__).resolve().parents[1] / "web" / "templates"
 cwd_dir = Path.cwd() / "web" / "templates"
 
 TEMPLATES_DIR = default_dir if default_dir.exists() else cwd_dir
+# auto_reload=False: una vez compilado, get_template no vuelve a hacer stat del archivo;
+# el bytecode cache (en el tmp del sistema) ahorra el parseo tras reiniciar
 env = Environment(
     loader=FileSystemLoader(str(TEMPLATES_DIR)),
     autoescape=select_autoescape(["html", "xml"]),
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(),
 )
 
-@router.get("/_debug", response_class=JSONResponse)
+HISTORIA_TEMPLATE = "historia_co.html"  # <- Debe existir en TEMPLATES_DIR
+
+# Precarga al importar; si falta, el error se reporta en la petición
+try:
+    TPL_HISTORIA = env.get_template(HISTORIA_TEMPLATE)
+except Exception:
+    TPL_HISTORIA = None
+
+@router.get("/_debug", response_class=ORJSONResponse)
 async def print_debug():
     """Muestra dónde está buscando templates y qué archivos ve."""
     return {
@@ -56,7 +68,7 @@ async def print_historia(encounter_id: str = Query(...)):
                 "NICE (UK)"
             ],
         }
-        tpl = env.get_template("historia_co.html")  # <- Debe existir en TEMPLATES_DIR
+        tpl = TPL_HISTORIA or env.get_template(HISTORIA_TEMPLATE)
         html = tpl.render(**data)
         return HTMLResponse(html, status_code=200)
     except Exception as e:
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from api.utils.keywords import compile_keywords
 
 def dedupe_letters(s: str) -> str:
     # “s s s s s” → “s”
@@ -9,78 +11,115 @@ def dedupe_letters(s: str) -> str:
 def _join_text(turns: List[Dict[str, Any]]) -> str:
     return " . ".join([(t.get("text") or "").strip() for t in (turns or []) if (t.get("text") or "").strip()]).lower()
 
-def extract_from_transcript(transcript: List[Dict[str, Any]]) -> Dict[str, Any]:
-    T = _join_text(transcript)
-
-    def has(*words) -> bool:
-        return any(w in T for w in words)
-
+# Disparadores: una sola pasada sobre T (en vez de un `in T` por palabra)
+_SCAN = compile_keywords({
+    "losart": "LOSARTAN", "furosemida": "FUROSEMIDA", "ibuprofeno": "IBUPROFENO",
+    "hipertens": "HTA", "cardiopat": "CARDIOPAT",
+    "sin alerg": "SIN_ALERGIAS", "no alerg": "SIN_ALERGIAS",
+    "tos": "TOS",
+    "disnea": "DISNEA", "falta de aire": "DISNEA", "ahog": "DISNEA", "dificultad para respirar": "DISNEA",
+    "crepitantes": "CREPITANTES",
+    "palpitaciones": "PALPITACIONES", "corazón muy rápido": "PALPITACIONES", "taquicardia": "PALPITACIONES",
+    "edema": "EDEMA", "hinchazón": "EDEMA", "tobillos": "EDEMA",
+    "fiebre": "FIEBRE",
+    "orino menos": "DIURESIS", "orino poco": "DIURESIS", "diuresis": "DIURESIS",
+    "labios morados": "CIANOSIS", "cianosis": "CIANOSIS",
+    "síncope": "SINCOPE", "sincope": "SINCOPE", "confusión": "SINCOPE", "confusion": "SINCOPE",
+})
+
+_RX_TA = re.compile(r"ta\s*(\d{2,3}\s*\/\s*\d{2,3})", re.I)
+_RX_FC = re.compile(r"fc\s*(\d{2,3})", re.I)
+_RX_FR = re.compile(r"fr\s*(\d{2,3})", re.I)
+_RX_TEMP = re.compile(r"(\b3[5-9](?:[.,]\d+)?)\s*°?c", re.I)
+_RX_SAT = re.compile(r"sato2\s*(\d{2,3})", re.I)
+_RX_SAT_ALERT = re.compile(r"sato2\s*(\d{2})")
+
+def _antecedentes(T: str, hits: Set[str]) -> Dict[str, Any]:
     antecedentes: Dict[str, Any] = {}
     # Farmacológicos
     meds = []
-    if "losart" in T: meds.append("Losartán (en curso)")
-    if "furosemida" in T: meds.append("Furosemida (en curso)")
-    if "ibuprofeno" in T: meds.append("Ibuprofeno (reciente)")
+    if "LOSARTAN" in hits: meds.append("Losartán (en curso)")
+    if "FUROSEMIDA" in hits: meds.append("Furosemida (en curso)")
+    if "IBUPROFENO" in hits: meds.append("Ibuprofeno (reciente)")
     if meds: antecedentes["farmacologicos"] = meds
 
     # Personales / patológicos
     pers = []
-    if "hipertens" in T: pers.append("Hipertensión arterial")
-    if "cardiopat" in T: pers.append("Cardiopatía conocida")
+    if "HTA" in hits: pers.append("Hipertensión arterial")
+    if "CARDIOPAT" in hits: pers.append("Cardiopatía conocida")
     if pers: antecedentes["personales"] = pers
 
-    if has("sin alerg", "no alerg"): antecedentes["alergias"] = ["Sin alergias conocidas"]
+    if "SIN_ALERGIAS" in hits: antecedentes["alergias"] = ["Sin alergias conocidas"]
+    return antecedentes
 
-    # Revisión por sistemas
+def _revision_sistemas(T: str, hits: Set[str]) -> Dict[str, Any]:
     ros: Dict[str, Any] = {}
     resp = []
-    if has("tos seca", "tos"): resp.append("Tos")
-    if has("disnea", "falta de aire", "ahog", "dificultad para respirar"): resp.append("Disnea de esfuerzo")
-    if "crepitantes" in T: resp.append("Ruidos crepitantes")
+    if "TOS" in hits: resp.append("Tos")
+    if "DISNEA" in hits: resp.append("Disnea de esfuerzo")
+    if "CREPITANTES" in hits: resp.append("Ruidos crepitantes")
     if resp: ros["respiratorio"] = resp
 
     cardio = []
-    if has("palpitaciones", "corazón muy rápido", "taquicardia"): cardio.append("Palpitaciones")
-    if has("edema", "hinchazón", "tobillos"): cardio.append("Edema maleolar")
+    if "PALPITACIONES" in hits: cardio.append("Palpitaciones")
+    if "EDEMA" in hits: cardio.append("Edema maleolar")
     if cardio: ros["cardiovascular"] = cardio
 
     gen = []
-    if has("fiebre"): gen.append("Fiebre (niega en esta consulta)")
+    if "FIEBRE" in hits: gen.append("Fiebre (niega en esta consulta)")
     if gen: ros["general"] = gen
 
     gu = []
-    if has("orino menos", "orino poco", "diuresis"): gu.append("Diuresis disminuida")
+    if "DIURESIS" in hits: gu.append("Diuresis disminuida")
     if gu: ros["genitourinario"] = gu
 
     if "neurologico" not in ros: ros["neurologico"] = "Sin cefalea intensa ni déficit"
     if "dermatologico" not in ros: ros["dermatologico"] = "Sin exantemas"
+    return ros
 
+def _examen_fisico(T: str, hits: Set[str]) -> Dict[str, Any]:
     # Signos vitales / hallazgos
     ef: Dict[str, Any] = {}
-    m = re.search(r"ta\s*(\d{2,3}\s*\/\s*\d{2,3})", T, re.I)
+    m = _RX_TA.search(T)
     if m: ef["TA"] = m.group(1).replace(" ", "")
-    m = re.search(r"fc\s*(\d{2,3})", T, re.I)
+    m = _RX_FC.search(T)
     if m: ef["FC"] = m.group(1)
-    m = re.search(r"fr\s*(\d{2,3})", T, re.I)
+    m = _RX_FR.search(T)
     if m: ef["FR"] = m.group(1)
-    m = re.search(r"(\b3[5-9](?:[.,]\d+)?)\s*°?c", T, re.I)
+    m = _RX_TEMP.search(T)
     if m: ef["Temp"] = m.group(1).replace(",", ".")
-    m = re.search(r"sato2\s*(\d{2,3})", T, re.I)
+    m = _RX_SAT.search(T)
     if m: ef["SatO2"] = m.group(1)
 
-    if "crepitantes" in T:
+    if "CREPITANTES" in hits:
         ef["hallazgos"] = (ef.get("hallazgos","") + " Crepitantes bibasales.").strip()
+    return ef
 
+def _alertas(T: str, hits: Set[str]) -> List[str]:
     # Alertas de seguridad básicas
     alertas: List[str] = []
-    if has("labios morados", "cianosis"): alertas.append("Cianosis")
-    if has("síncope", "sincope", "confusión", "confusion"): alertas.append("Síncope/Confusión")
-    if re.search(r"sato2\s*(\d{2})", T) and int(re.search(r"sato2\s*(\d{2})", T).group(1)) < 90:
+    if "CIANOSIS" in hits: alertas.append("Cianosis")
+    if "SINCOPE" in hits: alertas.append("Síncope/Confusión")
+    m = _RX_SAT_ALERT.search(T)
+    if m and int(m.group(1)) < 90:
         alertas.append("SatO2 < 90%")
-
-    return {
-        "antecedentes": antecedentes,
-        "revision_sistemas": ros,
-        "examen_fisico": ef,
-        "alertas": alertas
-    }
\ No newline at end of file
+    return alertas
+
+# Una función por sección: el llamador puede pedir solo las que le faltan
+_SECTIONS = {
+    "antecedentes": _antecedentes,
+    "revision_sistemas": _revision_sistemas,
+    "examen_fisico": _examen_fisico,
+    "alertas": _alertas,
+}
+
+def extract_from_transcript(
+    transcript: List[Dict[str, Any]],
+    joined_low: Optional[str] = None,
+    sections: Optional[Iterable[str]] = None,
+) -> Dict[str, Any]:
+    # joined_low: texto ya unido con " . " y en minúsculas (evita rearmarlo)
+    # sections: subconjunto de _SECTIONS a extraer (None = todas)
+    T = joined_low if joined_low is not None else _join_text(transcript)
+    hits = _SCAN(T)
+    return {k: _SECTIONS[k](T, hits) for k in (_SECTIONS if sections is None else sections)}
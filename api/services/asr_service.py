@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 """ASR (Automatic Speech Recognition) service."""
 
-from typing import List, Dict, Any
-from api.core.dependencies import transcribe_file
+from typing import AsyncIterator, List, Dict, Any
+from api.core.dependencies import transcribe_file, transcribe_stream
 
-__all__ = ["transcribe_audio"]
+__all__ = ["transcribe_audio", "transcribe_audio_stream"]
 
 
 def transcribe_audio(wav_path: str) -> List[Dict[str, Any]]:
@@ -18,3 +18,16 @@ def transcribe_audio(wav_path: str) -> List[Dict[str, Any]]:
         List of turns with speaker, text, timestamps
     """
     return transcribe_file(wav_path)
+
+
+def transcribe_audio_stream(wav_path: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream transcript turns as soon as the ASR decodes them.
+    
+    Args:
+        wav_path: Path to WAV audio file
+        
+    Returns:
+        Async iterator of turns with speaker, text, timestamps
+    """
+    return transcribe_stream(wav_path)
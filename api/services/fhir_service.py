@@ -2,11 +2,11 @@
 """FHIR service for building and pushing FHIR bundles."""
 
 from typing import Dict, Any
-import httpx
-from api.fhir_builder import build_bundle
+from api.fhir_builder import build_bundle, build_bundle_json
 from api.config import settings
+from api.utils.http import get_http_client
 
-__all__ = ["create_fhir_bundle", "push_to_fhir_server"]
+__all__ = ["create_fhir_bundle", "create_fhir_bundle_json", "push_to_fhir_server"]
 
 
 def create_fhir_bundle(
@@ -35,6 +35,28 @@ def create_fhir_bundle(
     )
 
 
+def create_fhir_bundle_json(
+    encounter_id: str,
+    patient_id: str,
+    practitioner_id: str,
+    json_clinico: Dict[str, Any]
+) -> bytes:
+    """
+    Build FHIR bundle already serialized to JSON bytes.
+    
+    Entries are serialized one by one, without building the full dict tree.
+    
+    Returns:
+        FHIR bundle as JSON bytes
+    """
+    return build_bundle_json(
+        encounter_id=encounter_id,
+        patient_id=patient_id,
+        practitioner_id=practitioner_id,
+        json_clinico=json_clinico
+    )
+
+
 async def push_to_fhir_server(bundle: Dict[str, Any]) -> Dict[str, Any]:
     """
     Push FHIR bundle to FHIR server.
@@ -45,11 +67,12 @@ async def push_to_fhir_server(bundle: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         Server response
     """
-    async with httpx.AsyncClient(timeout=60) as client:
-        response = await client.post(
-            settings.FHIR_BASE_URL,
-            json=bundle,
-            headers={"Content-Type": "application/fhir+json"},
-        )
-        response.raise_for_status()
-        return response.json()
+    # Cliente compartido del proceso: reutiliza la conexión al servidor FHIR
+    response = await get_http_client().post(
+        settings.FHIR_BASE_URL,
+        json=bundle,
+        headers={"Content-Type": "application/fhir+json"},
+        timeout=60,
+    )
+    response.raise_for_status()
+    return response.json()
@@ -6,6 +6,7 @@ from typing import Dict, Any, List
 from api.pubmed import pubmed_search, pubmed_ingest_to_files
 from api.augment import augment_with_pubmed
 from api.config import settings
+from api.utils.files import safe_filename
 
 __all__ = [
     "list_knowledge_files",
@@ -18,14 +19,15 @@ __all__ = [
 
 def list_knowledge_files() -> List[str]:
     """
-    List all knowledge files in the knowledge directory.
+    List all knowledge files (regular files only) in the knowledge directory.
     
     Returns:
         List of filenames
     """
     os.makedirs(settings.KNOWLEDGE_DIR, exist_ok=True)
-    files = [f for f in os.listdir(settings.KNOWLEDGE_DIR) if not f.startswith(".")]
-    return files
+    # scandir: iterador perezoso; is_file() usa el d_type sin stat extra
+    with os.scandir(settings.KNOWLEDGE_DIR) as it:
+        return [e.name for e in it if not e.name.startswith(".") and e.is_file()]
 
 
 def save_knowledge_file(filename: str, content: str) -> str:
@@ -33,14 +35,17 @@ def save_knowledge_file(filename: str, content: str) -> str:
     Save content to a knowledge file.
     
     Args:
-        filename: Name of the file
+        filename: Name of the file (no path separators)
         content: File content
         
     Returns:
         Path to saved file
+        
+    Raises:
+        ValueError: if filename is not a plain file name
     """
     os.makedirs(settings.KNOWLEDGE_DIR, exist_ok=True)
-    path = os.path.join(settings.KNOWLEDGE_DIR, filename)
+    path = os.path.join(settings.KNOWLEDGE_DIR, safe_filename(filename))
     with open(path, "w", encoding="utf-8") as f:
         f.write(content)
     return path
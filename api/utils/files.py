@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Validación de nombres de archivo recibidos por HTTP."""
+
+__all__ = ["safe_filename"]
+
+# Nombres de dispositivo reservados (Windows); se comparan sin extensión
+_RESERVED = frozenset(
+    ["con", "prn", "aux", "nul"]
+    + [f"com{i}" for i in range(1, 10)]
+    + [f"lpt{i}" for i in range(1, 10)]
+)
+
+
+def safe_filename(name: str) -> str:
+    """
+    Devuelve `name` si es un nombre plano (sin directorios) y lanza ValueError si no.
+    Rechaza separadores, NUL, vacíos, "."/"..", ocultos (p.ej. sidecars de índices)
+    y nombres reservados.
+    """
+    clean = (name or "").strip()
+    if (not clean or clean.startswith(".")
+            or "/" in clean or "\\" in clean or "\x00" in clean
+            or clean.split(".", 1)[0].lower() in _RESERVED):
+        raise ValueError(f"nombre de archivo inválido: {name!r}")
+    return clean
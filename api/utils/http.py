@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Cliente httpx compartido (keep-alive) para LLM, FHIR y PubMed."""
+
+from typing import Optional
+
+import httpx
+
+from api.config.settings import settings
+
+__all__ = ["get_http_client", "close_http_client"]
+
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Devuelve el AsyncClient del proceso (se crea en el primer uso).
+    Reutiliza conexiones: sin handshake TCP/TLS por llamada.
+    El timeout por defecto es el del LLM; cada llamada puede pasar el suyo.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=120,
+            # gzip explícito: esearch/efetch devuelven JSON/XML que comprime bien
+            headers={"Accept-Encoding": "gzip", "User-Agent": "scribe-ia/1.0"},
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE,
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+            ),
+        )
+    return _CLIENT
+
+
+async def close_http_client() -> None:
+    """Cierra el cliente compartido (llamar en shutdown)."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
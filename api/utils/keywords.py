@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Escáner de palabras clave en una sola pasada (alternativa stdlib a Aho-Corasick)."""
+
+import re
+from typing import Callable, Dict, Iterable, Set, Tuple, Union
+
+__all__ = ["compile_keywords"]
+
+
+def compile_keywords(
+    table: Union[Dict[str, str], Iterable[Tuple[str, str]]]
+) -> Callable[[str], Set[str]]:
+    """
+    Compila {palabra_clave: etiqueta} en un único patrón y devuelve
+    `scan(texto) -> {etiquetas}` con semántica de subcadena (`kw in texto`).
+    El lookahead permite solapes entre claves (p.ej. "alta" dentro de "falta").
+    """
+    pairs = list(table.items() if isinstance(table, dict) else table)
+    tag_of: Dict[str, str] = {}
+    for kw, tag in pairs:
+        tag_of[kw] = tag
+    kws = sorted(tag_of, key=len, reverse=True)
+    # Dos claves que empiezan en el mismo punto solo dan un match: exigimos
+    # que un prefijo comparta etiqueta con la clave más larga.
+    for i, long_kw in enumerate(kws):
+        for short_kw in kws[i + 1:]:
+            if long_kw.startswith(short_kw) and tag_of[long_kw] != tag_of[short_kw]:
+                raise ValueError(f"clave {short_kw!r} es prefijo de {long_kw!r} con otra etiqueta")
+    rx = re.compile("(?=(" + "|".join(map(re.escape, kws)) + "))")
+
+    def scan(text: str) -> Set[str]:
+        return {tag_of[m.group(1)] for m in rx.finditer(text or "")}
+
+    return scan
@@ -2,8 +2,36 @@
 import re
 from datetime import datetime
 
+from api.utils.keywords import compile_keywords
+
 MAX_EA = 380  # recorte de Enfermedad Actual si viene muy larga
 
+# Patrones precompilados (se usan en cada transcript)
+_RX_WS = re.compile(r"\s+")
+_RX_SENT = re.compile(r"(?<=\.)\s+")
+_RX_TA = re.compile(r"ta\s*(\d{2,3}\s*/\s*\d{2,3})", re.I)
+_RX_FC = re.compile(r"fc\s*(\d{2,3})", re.I)
+_RX_FR = re.compile(r"fr\s*(\d{2,3})", re.I)
+_RX_TEMP = re.compile(r"(\b3[5-9](?:[.,]\d+)?)\s*°?\s*c", re.I)
+_RX_SAT = re.compile(r"sato2\s*(\d{2,3})\s*%", re.I)
+
+# Disparadores de reglas: una sola pasada sobre T devuelve las etiquetas presentes
+_SCAN_RULES = compile_keywords({
+    "hipertens": "HTA", "cardiopat": "CARDIOPAT",
+    "losart": "LOSARTAN", "furosemida": "FUROSEMIDA", "ibuprofeno": "IBUPROFENO",
+    "sin alerg": "SIN_ALERGIAS", "no alerg": "SIN_ALERGIAS",
+    "no fumo": "NO_FUMA", "no fuma": "NO_FUMA",
+    "sal": "SAL", "más": "MAS", "mas": "MAS", "alta": "MAS",
+    "disnea": "DISNEA", "falta de aire": "DISNEA", "ahog": "DISNEA",
+    "tos": "TOS", "seca": "SECA",
+    "palpitaciones": "PALPITACIONES", "rápido": "PALPITACIONES", "rapido": "PALPITACIONES",
+    "edema": "EDEMA", "hinchazón": "HINCHAZON", "hinchazon": "HINCHAZON", "tobillos": "HINCHAZON",
+    "orino menos": "DIURESIS", "orino poco": "DIURESIS", "diuresis": "DIURESIS",
+    "aumento de peso": "PESO", "subido": "PESO", "3 kilos": "PESO",
+    "crepitantes": "CREPITANTES", "ingurgit": "INGURGITACION", "hepatomeg": "HEPATOMEGALIA",
+    "s3": "S3", "sin soplos": "SIN_SOPLOS",
+})
+
 def _lower(s): return (s or "").lower()
 
 def compact_enfermedad_actual(ea):
@@ -11,10 +39,10 @@ def compact_enfermedad_actual(ea):
         return ea
     if isinstance(ea, dict):
         return ea
-    s = re.sub(r"\s+", " ", str(ea)).strip()
+    s = _RX_WS.sub(" ", str(ea)).strip()
     if len(s) <= MAX_EA:
         return s
-    parts = re.split(r"(?<=\.)\s+", s)
+    parts = _RX_SENT.split(s)
     out = []
     for p in parts:
         out.append(p)
@@ -37,68 +65,65 @@ def extract_rules_from_transcript(transcript):
     }
     ef = {}
 
+    hits = _SCAN_RULES(T)
+
     # antecedentes / fármacos / hábitos
-    if "hipertens" in T:
+    if "HTA" in hits:
         ant["personales"].append("Hipertensión arterial")
         ant["patologicos"].append("Hipertensión arterial")
-    if "cardiopat" in T:
+    if "CARDIOPAT" in hits:
         ant["personales"].append("Cardiopatía")
 
-    if "losart" in T:     ant["farmacologicos"].append("Losartán 50 mg/día")
-    if "furosemida" in T: ant["farmacologicos"].append("Furosemida 20 mg mañana (olvidos esporádicos)")
-    if "ibuprofeno" in T: ant["farmacologicos"].append("Ibuprofeno (reciente)")
+    if "LOSARTAN" in hits:   ant["farmacologicos"].append("Losartán 50 mg/día")
+    if "FUROSEMIDA" in hits: ant["farmacologicos"].append("Furosemida 20 mg mañana (olvidos esporádicos)")
+    if "IBUPROFENO" in hits: ant["farmacologicos"].append("Ibuprofeno (reciente)")
 
-    if "sin alerg" in T or "no alerg" in T:
+    if "SIN_ALERGIAS" in hits:
         ant["alergias"].append("Sin alergias conocidas")
 
-    if "no fumo" in T or "no fuma" in T:
+    if "NO_FUMA" in hits:
         ant["toxicos_habitos"].append("No fuma")
-    if "sal" in T and ("más" in T or "mas" in T or "alta" in T):
+    if "SAL" in hits and "MAS" in hits:
         ant["toxicos_habitos"].append("Ingesta de sal aumentada")
 
     # ROS
-    if any(k in T for k in ["disnea","falta de aire","ahog"]):
+    if "DISNEA" in hits:
         ros["respiratorio"].extend(["Disnea de esfuerzo","Ortopnea","Disnea paroxística nocturna"])
-    if "tos" in T and "seca" in T:
+    if "TOS" in hits and "SECA" in hits:
         ros["respiratorio"].append("Tos seca")
-    if any(k in T for k in ["palpitaciones","rápido","rapido"]):
+    if "PALPITACIONES" in hits:
         ros["cardiovascular"].append("Palpitaciones")
-    if any(k in T for k in ["edema","hinchazón","hinchazon","tobillos"]):
+    if "EDEMA" in hits or "HINCHAZON" in hits:
         ros["musculoesqueletico"].append("Edema maleolar")
-    if any(k in T for k in ["orino menos","orino poco","diuresis"]):
+    if "DIURESIS" in hits:
         ros["genitourinario"].append("Diuresis disminuida")
-    if any(k in T for k in ["aumento de peso","subido","3 kilos"]):
+    if "PESO" in hits:
         ros["general"].append("Aumento de peso reciente")
 
     # EF
-    m = re.search(r"ta\s*(\d{2,3}\s*/\s*\d{2,3})", T, re.I)
+    m = _RX_TA.search(T)
     if m: ef["TA"] = m.group(1).replace(" ","")
-    m = re.search(r"fc\s*(\d{2,3})", T, re.I)
+    m = _RX_FC.search(T)
     if m: ef["FC"] = m.group(1)
-    m = re.search(r"fr\s*(\d{2,3})", T, re.I)
+    m = _RX_FR.search(T)
     if m: ef["FR"] = m.group(1)
-    m = re.search(r"(\b3[5-9](?:[.,]\d+)?)\s*°?\s*c", T, re.I)
+    m = _RX_TEMP.search(T)
     if m: ef["Temp"] = m.group(1).replace(",","." )
-    m = re.search(r"sato2\s*(\d{2,3})\s*%", T, re.I)
+    m = _RX_SAT.search(T)
     if m: ef["SatO2"] = m.group(1)
 
     hall = []
-    if "crepitantes" in T: hall.append("Crepitantes bibasales")
-    if "ingurgit" in T:    hall.append("Ingurgitación yugular +")
-    if "hepatomeg" in T:   hall.append("Hepatomegalia leve")
-    if "edema" in T:       hall.append("Edema blando maleolar bilateral +/++")
-    if "s3" in T:          hall.append("S3 audible")
-    if "sin soplos" in T:  hall.append("Sin soplos evidentes")
+    if "CREPITANTES" in hits:   hall.append("Crepitantes bibasales")
+    if "INGURGITACION" in hits: hall.append("Ingurgitación yugular +")
+    if "HEPATOMEGALIA" in hits: hall.append("Hepatomegalia leve")
+    if "EDEMA" in hits:         hall.append("Edema blando maleolar bilateral +/++")
+    if "S3" in hits:            hall.append("S3 audible")
+    if "SIN_SOPLOS" in hits:    hall.append("Sin soplos evidentes")
     if hall:
         ef["hallazgos"] = ", ".join(hall) + "."
 
-    # dedup/limpieza
-    for k in ant:
-        if isinstance(ant[k], list):
-            ant[k] = sorted(list({x.strip() for x in ant[k] if x.strip()}))
-    for k in ros:
-        if isinstance(ros[k], list):
-            ros[k] = sorted(list({x.strip() for x in ros[k] if x.strip()}))
+    # Sin pasada de dedup/strip: cada disparador agrega a lo sumo una vez un literal
+    # distinto y ya limpio por categoría, así que las listas salen únicas
     return ant, ros, ef
 
 def merge_and_normalize(json_llm: dict, transcript: list) -> dict:
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Respuestas JSON pre-serializadas con orjson (sin pasar por jsonable_encoder)."""
+
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi import Response
+
+__all__ = ["json_response"]
+
+_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _json_default(obj: Any) -> Any:
+    """Tipos que orjson no serializa por sí mismo."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """Serializa `content` a bytes una sola vez y lo devuelve tal cual."""
+    return Response(
+        content=orjson.dumps(content, default=_json_default, option=_OPTS),
+        status_code=status_code,
+        media_type="application/json",
+    )
@@ -61,10 +61,32 @@ def test_imports():
     
     return tests
 
+def test_bp_parsing():
+    """Regresión de parse_blood_pressure: el separador explícito gana al espacio."""
+    from api.fhir_builder import parse_blood_pressure
+    cases = [
+        ("fc 88 120/80", (120.0, 80.0)),
+        ("38.5 120/80", (120.0, 80.0)),
+        ("12/8", (12.0, 8.0)),
+        ("13/9 cmHg", (13.0, 9.0)),
+        ("120 sobre 80", (120.0, 80.0)),
+        ("120x80", (120.0, 80.0)),
+        ("TA 120 80", (120.0, 80.0)),
+        ("sin dato", None),
+    ]
+    tests = []
+    for text, expected in cases:
+        got = parse_blood_pressure(text)
+        if got == expected:
+            tests.append((f"✅ TA {text!r}", True))
+        else:
+            tests.append((f"❌ TA {text!r}", False, f"{got} != {expected}"))
+    return tests
+
 if __name__ == "__main__":
     print("🔍 Verificando nueva arquitectura de scribe-ia...\n")
     
-    results = test_imports()
+    results = test_imports() + test_bp_parsing()
     
     for result in results:
         if len(result) == 2: